@@ -0,0 +1,184 @@
+"""
+Offline stand-in for the spacetime cache server.
+
+    python -m benchmarks.cache_server [--port 8765] [--latency 0.05] ...
+    python launch.py --restart --local_cache 127.0.0.1:8765
+
+It speaks the same protocol as utils/download.download: GET /?q=<url>&u=<agent>
+answered with CBOR of {"url", "status", "error"?, "response"?}, where
+"response" is a pickled requests.Response. Pages come from a deterministic
+synthetic site graph spread over several *.ics.uci.edu hosts, with
+configurable latency, cache errors (600-608), redirects, 404s and traps
+(unbounded ?page= listings and calendar days).
+"""
+import cbor
+import pickle
+import random
+import time
+import zlib
+
+from argparse import ArgumentParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+
+from requests.models import Response as RequestsResponse
+from requests.structures import CaseInsensitiveDict
+
+SYLLABLES = ("da", "ta", "in", "fo", "com", "learn", "graph", "net", "lo", "gic",
+             "stat", "co", "de", "mo", "del", "que", "ry", "rob", "vi", "sion")
+VOCABULARY = [a + b + c for a in SYLLABLES for b in SYLLABLES for c in ("", "s", "ing")]
+TOPIC_WORDS = 80 # distinct words per page, drawn from VOCABULARY
+
+
+class SyntheticSite(object):
+    """
+    Deterministic site graph: the page for a url is generated from a seed
+    derived from the url, so every run (and every shard) sees the same graph.
+    """
+    def __init__(self, hosts=8, pages_per_host=500, links_per_page=20,
+                 words_per_page=400, error_rate=0.01, redirect_rate=0.02,
+                 not_found_rate=0.02, trap_rate=0.05, seed=0):
+        self.hosts = [f"host{i}.ics.uci.edu" for i in range(hosts)]
+        self.pages_per_host = pages_per_host
+        self.links_per_page = links_per_page
+        self.words_per_page = words_per_page
+        self.error_rate = error_rate
+        self.redirect_rate = redirect_rate
+        self.not_found_rate = not_found_rate
+        self.trap_rate = trap_rate
+        self.seed = seed
+        # Zipf-like word weights, so term frequencies look like real text.
+        self.weights = [1 / (rank + 1) for rank in range(TOPIC_WORDS)]
+
+    @property
+    def seed_urls(self):
+        return [f"https://{host}/page/0" for host in self.hosts]
+
+    def _rng(self, url):
+        return random.Random(zlib.crc32(url.encode("utf-8")) ^ self.seed)
+
+    def _random_link(self, rng, host):
+        roll = rng.random()
+        if roll < self.trap_rate:
+            if rng.random() < 0.5:
+                return f"https://{host}/events/?page={rng.randrange(10**6)}"
+            return (f"https://{host}/calendar/{rng.randrange(2000, 2030)}/"
+                    f"{rng.randrange(1, 13)}/{rng.randrange(1, 29)}")
+        target = host if rng.random() < 0.8 else rng.choice(self.hosts)
+        page = rng.randrange(self.pages_per_host)
+        if target == host and rng.random() < 0.5:
+            return f"/page/{page}#section" # relative, with a fragment
+        return f"https://{target}/page/{page}"
+
+    def page_words(self, rng):
+        ''' The words of one page: a topic drawn from VOCABULARY, Zipf weighted. '''
+        topic = rng.sample(VOCABULARY, TOPIC_WORDS) # so pages are not near duplicates
+        return rng.choices(topic, weights=self.weights, k=self.words_per_page)
+
+    def fetch(self, url):
+        ''' Return (status, headers, body, error) for url. '''
+        parsed = urlsplit(url)
+        host = (parsed.hostname or "").lower()
+        rng = self._rng(url)
+        if host not in self.hosts:
+            return 603, {}, None, "Url is not in the synthetic site."
+        roll = rng.random()
+        if roll < self.error_rate:
+            status = rng.randrange(600, 609)
+            return status, {}, None, f"Synthetic cache error {status}."
+        roll -= self.error_rate
+        if roll < self.redirect_rate:
+            target = f"https://{host}/page/{rng.randrange(self.pages_per_host)}"
+            return rng.choice((301, 302)), {"Location": target}, b"", None
+        roll -= self.redirect_rate
+        if roll < self.not_found_rate:
+            return 404, {"Content-Type": "text/html"}, b"<html><body>Not found</body></html>", None
+
+        words = self.page_words(rng)
+        links = [self._random_link(rng, host) for _ in range(self.links_per_page)]
+        body = (
+            "<html><head><title>" + " ".join(words[:5]) + "</title>"
+            "<style>body { margin: 0 }</style></head><body><p>"
+            + " ".join(words) + "</p><ul>"
+            + "".join(f'<li><a href="{link}">{link}</a></li>' for link in links)
+            + "</ul><script>var page = 1;</script></body></html>").encode("utf-8")
+        return 200, {"Content-Type": "text/html; charset=utf-8"}, body, None
+
+
+def make_handler(site, latency, jitter):
+    class CacheHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # keep-alive, like the real cache
+        disable_nagle_algorithm = True # headers and body go out as separate writes
+
+        def do_GET(self):
+            params = dict(parse_qsl(urlsplit(self.path).query))
+            url = params.get("q", "")
+            if latency or jitter:
+                time.sleep(max(0.0, latency + random.uniform(-jitter, jitter)))
+            status, headers, body, error = site.fetch(url)
+            resp_dict = {"url": url, "status": status}
+            if error:
+                resp_dict["error"] = error
+            if body is not None:
+                raw = RequestsResponse()
+                raw.status_code = status
+                raw.url = url
+                raw.headers = CaseInsensitiveDict(headers)
+                raw._content = body
+                raw.encoding = "utf-8"
+                resp_dict["response"] = pickle.dumps(raw)
+            payload = cbor.dumps(resp_dict)
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def handle(self):
+            try:
+                super().handle()
+            except ConnectionError:
+                pass # the crawler went away mid-request, e.g. killed by resume_crawl
+
+        def log_message(self, format, *args):
+            pass # one line per request would dominate the benchmark
+
+    return CacheHandler
+
+
+def serve(site, host="127.0.0.1", port=8765, latency=0.0, jitter=0.0):
+    server = ThreadingHTTPServer((host, port), make_handler(site, latency, jitter))
+    server.daemon_threads = True
+    return server
+
+
+def add_site_arguments(parser):
+    parser.add_argument("--hosts", type=int, default=8)
+    parser.add_argument("--pages_per_host", type=int, default=500)
+    parser.add_argument("--links_per_page", type=int, default=20)
+    parser.add_argument("--error_rate", type=float, default=0.01)
+    parser.add_argument("--redirect_rate", type=float, default=0.02)
+    parser.add_argument("--not_found_rate", type=float, default=0.02)
+    parser.add_argument("--trap_rate", type=float, default=0.05)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def site_from_args(args):
+    return SyntheticSite(
+        hosts=args.hosts, pages_per_host=args.pages_per_host,
+        links_per_page=args.links_per_page, error_rate=args.error_rate,
+        redirect_rate=args.redirect_rate, not_found_rate=args.not_found_rate,
+        trap_rate=args.trap_rate, seed=args.seed)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    add_site_arguments(parser)
+    args = parser.parse_args()
+    site = site_from_args(args)
+    server = serve(site, port=args.port, latency=args.latency, jitter=args.jitter)
+    print(f"Serving {len(site.hosts)} synthetic hosts on port {server.server_port}, "
+          f"seeds: {','.join(site.seed_urls)}", flush=True)
+    server.serve_forever()
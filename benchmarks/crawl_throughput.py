@@ -0,0 +1,154 @@
+"""
+End-to-end crawl throughput against the offline cache server stand-in.
+
+    python -m benchmarks.crawl_throughput [--threads 4] [--max_pages 2000] ... 2>/dev/null
+
+Starts benchmarks.cache_server in a subprocess, runs the real Crawler
+(frontier, workers, downloads, scraper) against it from a scratch directory
+with --restart semantics, and reports pages per second, CPU time per page
+(this process plus reaped parse processes), peak memory growth and how many
+unique pages and subdomains made it into the report.
+Site options (--hosts, --latency, --error_rate, ...) are passed to the server.
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from argparse import ArgumentParser
+from configparser import ConfigParser
+
+from benchmarks.cache_server import add_site_arguments, site_from_args
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SITE_ARGUMENTS = ("hosts", "pages_per_host", "links_per_page", "error_rate",
+                  "redirect_rate", "not_found_rate", "trap_rate", "latency",
+                  "jitter", "seed")
+
+
+def start_server(args):
+    command = [sys.executable, "-m", "benchmarks.cache_server", "--port", "0"]
+    for name in SITE_ARGUMENTS:
+        command += [f"--{name}", str(getattr(args, name))]
+    server = subprocess.Popen(
+        command, cwd=REPO_DIR, stdout=subprocess.PIPE, text=True)
+    banner = server.stdout.readline() # "Serving N synthetic hosts on port P, ..."
+    port = int(banner.split(" on port ")[1].split(",")[0])
+    return server, port
+
+
+def make_config(args, port, site):
+    # Imported here so REPO_DIR is on the path before the crawler modules load.
+    from utils.config import Config
+    cparser = ConfigParser()
+    cparser.read(os.path.join(REPO_DIR, args.config_file))
+    cparser["CRAWLER"]["SEEDURL"] = ",".join(site.seed_urls)
+    cparser["CRAWLER"]["POLITENESS"] = str(args.politeness)
+    cparser["LOCAL PROPERTIES"]["SAVE"] = "frontier.shelve"
+    cparser["LOCAL PROPERTIES"]["THREADCOUNT"] = str(args.threads)
+    if args.parse_processes is not None:
+        cparser["LOCAL PROPERTIES"]["PARSEPROCESSES"] = str(args.parse_processes)
+    if args.in_flight is not None:
+        if not cparser.has_section("DOWNLOAD"):
+            cparser.add_section("DOWNLOAD")
+        cparser["DOWNLOAD"]["INFLIGHT"] = str(args.in_flight)
+    if args.hot_urls is not None:
+        cparser["LOCAL PROPERTIES"]["HOTURLS"] = str(args.hot_urls)
+    if args.priority is not None:
+        cparser["CRAWLER"]["PRIORITY"] = args.priority
+    config = Config(cparser)
+    config.cache_server = ("127.0.0.1", port)
+    return config
+
+
+def counting_frontier(max_pages):
+    from crawler.frontier import Frontier
+
+    class CountingFrontier(Frontier):
+        ''' Counts completed pages and stops handing out urls after max_pages. '''
+        def __init__(self, config, restart):
+            super().__init__(config, restart)
+            self.completed = 0
+            self.handed_out = 0
+
+        def get_tbd_url(self, wait=True, timeout=None):
+            with self.lock:
+                if self._limit_reached():
+                    if wait: # until the pages handed out are done
+                        self.host_ready.wait_for(lambda: not self.in_flight, timeout)
+                    return None
+            url = super().get_tbd_url(wait, timeout)
+            if url:
+                with self.lock:
+                    self.handed_out += 1
+            return url
+
+        def done(self):
+            with self.lock:
+                return super().done() or (self._limit_reached() and not self.in_flight)
+
+        def _limit_reached(self):
+            return max_pages and self.handed_out >= max_pages
+
+        def mark_url_complete(self, url):
+            super().mark_url_complete(url)
+            with self.lock:
+                self.completed += 1
+
+    return CountingFrontier
+
+
+def cpu_seconds():
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def main(args):
+    sys.path.insert(0, REPO_DIR)
+    site = site_from_args(args)
+    server, port = start_server(args)
+    os.chdir(tempfile.mkdtemp(prefix="crawl_throughput_")) # save files, Logs/ and report/
+    try:
+        from crawler import Crawler
+        config = make_config(args, port, site)
+        start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start_cpu = cpu_seconds()
+        start = time.perf_counter()
+        crawler = Crawler(config, True, frontier_factory=counting_frontier(args.max_pages))
+        crawler.start() # parse processes are reaped at close, so their CPU is counted
+        elapsed = time.perf_counter() - start
+        cpu = cpu_seconds() - start_cpu
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    finally:
+        server.terminate()
+        server.wait()
+
+    pages = crawler.frontier.completed
+    scale = 1 if sys.platform == "darwin" else 1024 # ru_maxrss is bytes on macOS, KiB elsewhere
+    print(f"scratch dir: {os.getcwd()}")
+    print(f"threads {args.threads}, politeness {args.politeness}s, "
+          f"latency {args.latency}s +/- {args.jitter}s, {len(site.hosts)} hosts")
+    print(f"pages: {pages} in {elapsed:.2f}s -> {pages / elapsed:.1f} pages/s")
+    if pages:
+        print(f"cpu: {cpu:.2f}s -> {cpu / pages * 1000:.2f} ms/page")
+    print(f"peak rss: {peak_rss * scale / 2**20:.1f} MiB "
+          f"(+{(peak_rss - start_rss) * scale / 2**20:.1f} MiB during the crawl)")
+    import scraper
+    print(f"report: {sum(scraper.REPORT.subdomain_counts.values())} pages kept from "
+          f"{len(scraper.REPORT.subdomain_counts)} subdomains")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--politeness", type=float, default=0.05)
+    parser.add_argument("--max_pages", type=int, default=2000, help="0 = crawl until the frontier is empty")
+    parser.add_argument("--in_flight", type=int, default=None, help="overrides INFLIGHT")
+    parser.add_argument("--parse_processes", type=int, default=None, help="overrides PARSEPROCESSES")
+    parser.add_argument("--priority", type=str, default=None, help="overrides PRIORITY")
+    parser.add_argument("--hot_urls", type=int, default=None, help="overrides HOTURLS")
+    add_site_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,104 @@
+"""
+Compare the HTML parser backends in utils/parsers.py on a saved page corpus.
+
+    python -m benchmarks.parse_backends [path/to/corpus] [--repeat 3]
+
+Every file in the corpus directory is treated as one page body. For each
+available backend this prints the total time and pages/sec, and the number of
+pages whose (text, hrefs) output differs from the bs4 backend. Without a
+corpus, only EDGE_CASES are checked; they are checked on every run.
+"""
+import os
+import time
+
+from argparse import ArgumentParser
+
+from utils.parsers import BACKENDS, get_extractor
+
+# Markup where the backends' parsers behave differently, which every backend
+# must still turn into the same (text, hrefs).
+EDGE_CASES = {
+    "hidden_element_tail": b"<p>x<script>..</script>y</p>",
+    "style_and_template": b"<p>x<style>s</style><b>y</b><template>t</template>w</p>",
+    "link_in_template": b'<template><a href="t">',
+    "duplicate_href": b'<a href="a" href="b">z</a>',
+    "cdata": b"<p>a<![CDATA[cd]]>b</p>",
+    "cdata_markup": b"<p>a<![CDATA[x<y]]>b</p>",
+    "comment": b"<p>x<!-- c -->y</p>",
+    "ruby_unclosed_rt": b"<ruby>k<rt>kan</ruby> after ruby",
+    "ruby_rp": b"<ruby>k<rp>(<rt>kan<rp>)</ruby> after",
+    "ruby_closed_rt": b"<ruby>k<rt>kan</rt>j<rt>ji</rt></ruby> z",
+    "meta_charset": '<meta charset="shift_jis"><p>日本語</p>'.encode("shift_jis"),
+}
+
+def load_corpus(corpus_dir):
+    pages = list()
+    for name in sorted(os.listdir(corpus_dir)):
+        path = os.path.join(corpus_dir, name)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                pages.append((name, f.read()))
+    return pages
+
+
+def check_edge_cases():
+    extractors = dict()
+    for name in BACKENDS:
+        try:
+            extractors[name] = get_extractor(name)
+        except ValueError:
+            pass
+    reference = next(iter(extractors))
+    failed = [
+        case for case, content in EDGE_CASES.items()
+        if any(extract(content) != extractors[reference](content)
+               for extract in extractors.values())]
+    print(f"edge cases: {len(EDGE_CASES) - len(failed)}/{len(EDGE_CASES)} agree "
+          f"across {', '.join(extractors)}")
+    for case in failed:
+        content = EDGE_CASES[case]
+        print(f"{'':>10}{case}: " + ", ".join(
+            f"{name} {extract(content)!r}" for name, extract in extractors.items()))
+    return not failed
+
+
+def main(corpus_dir, repeat):
+    check_edge_cases()
+    if corpus_dir is None:
+        return
+    pages = load_corpus(corpus_dir)
+    if not pages:
+        raise SystemExit(f"No pages found in {corpus_dir}.")
+    size = sum(len(content) for _, content in pages)
+    print(f"{len(pages)} pages, {size / 1e6:.1f} MB, best of {repeat} runs")
+
+    reference = None
+    for name in BACKENDS:
+        try:
+            extract = get_extractor(name)
+        except ValueError as e:
+            print(f"{name:>8}: skipped ({e})")
+            continue
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            outputs = [extract(content) for _, content in pages]
+            best = min(best, time.perf_counter() - start)
+        if reference is None:
+            reference = outputs
+        mismatches = [
+            page_name for (page_name, _), out, ref
+            in zip(pages, outputs, reference) if out != ref]
+        print(
+            f"{name:>8}: {best:.3f}s, {len(pages) / best:.1f} pages/sec, "
+            f"{len(mismatches)} pages differ from {next(iter(BACKENDS))}")
+        for page_name in mismatches[:5]:
+            print(f"{'':>10}{page_name}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("corpus_dir", type=str, nargs="?", default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    main(args.corpus_dir, args.repeat)
@@ -0,0 +1,131 @@
+"""
+Kill-and-resume crawl of the offline cache server stand-in.
+
+    python -m benchmarks.resume_crawl [--kills 2] [--kill_after 2] [--threads 4] ...
+
+Starts benchmarks.cache_server and runs `launch.py` three ways from a scratch
+directory, as sharded_crawl does:
+    full     -- one uninterrupted crawl with --restart
+    resumed  -- a crawl with --restart that is SIGKILLed kill_after seconds in,
+                then resumed without --restart (and killed again, `kills`
+                times in all) until it finishes
+    restart  -- --restart again over the finished full crawl
+Then it checks that the resumed and restarted reports match the full one:
+unique pages, word totals, subdomain counts, the length of the longest page
+(pages of equal length may win in any order) and the duplicate counts. The
+site defaults have no random errors, so every run of the same site crawls
+the same pages.
+"""
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from argparse import ArgumentParser
+from configparser import ConfigParser
+
+from benchmarks.cache_server import add_site_arguments, site_from_args
+from benchmarks.crawl_throughput import REPO_DIR, start_server
+from benchmarks.sharded_crawl import load_state
+
+
+def write_config(args, site, path):
+    cparser = ConfigParser()
+    cparser.read(os.path.join(REPO_DIR, args.config_file))
+    cparser["CRAWLER"]["SEEDURL"] = ",".join(site.seed_urls)
+    cparser["CRAWLER"]["POLITENESS"] = str(args.politeness)
+    cparser["LOCAL PROPERTIES"]["SAVE"] = "frontier.shelve"
+    cparser["LOCAL PROPERTIES"]["THREADCOUNT"] = str(args.threads)
+    with open(path, "w") as f:
+        cparser.write(f)
+
+
+def crawl(directory, port, restart, kill_after=None):
+    ''' Run launch.py in directory; returns False if it was killed. '''
+    command = [
+        sys.executable, os.path.join(REPO_DIR, "launch.py"),
+        "--config_file", "config.ini", "--local_cache", f"127.0.0.1:{port}"]
+    if restart:
+        command.append("--restart")
+    process = subprocess.Popen(
+        command, cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        _, errors = process.communicate(timeout=kill_after)
+    except subprocess.TimeoutExpired:
+        process.send_signal(signal.SIGKILL)
+        process.communicate()
+        return False
+    if process.returncode:
+        raise SystemExit(f"launch.py failed in {directory}:\n{errors.decode()[-3000:]}")
+    return True
+
+
+def summary(directory):
+    state = load_state(os.path.join(directory, "report"))
+    return {
+        "pages": len(state["unique_pages"]),
+        "words": sum(state["word_freq"].values()),
+        "subdomains": state["subdomain_counts"],
+        "longest page words": state["longest_page"][1],
+        "duplicates": state["duplicates"],
+    }
+
+
+def main(args):
+    site = site_from_args(args)
+    server, port = start_server(args)
+    scratch = tempfile.mkdtemp(prefix="resume_crawl_")
+    runs = {name: os.path.join(scratch, name) for name in ("full", "resumed")}
+    for directory in runs.values():
+        os.makedirs(directory)
+        write_config(args, site, os.path.join(directory, "config.ini"))
+    try:
+        start = time.perf_counter()
+        crawl(runs["full"], port, restart=True)
+        full_seconds = time.perf_counter() - start
+        full = summary(runs["full"])
+
+        kills = 0
+        finished = crawl(runs["resumed"], port, restart=True, kill_after=args.kill_after)
+        while not finished:
+            kills += 1
+            finished = crawl(
+                runs["resumed"], port, restart=False,
+                kill_after=args.kill_after if kills < args.kills else None)
+        resumed = summary(runs["resumed"])
+
+        crawl(runs["full"], port, restart=True)
+        restarted = summary(runs["full"])
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"scratch dir: {scratch}")
+    print(f"full: {full['pages']} pages, {full['words']} words in {full_seconds:.1f}s")
+    if kills < args.kills:
+        print(f"only {kills} of {args.kills} kills landed before the crawl finished, "
+              f"lower --kill_after")
+    for name, result in (("resumed", resumed), ("restart", restarted)):
+        print(f"{name}: {result['pages']} pages, {result['words']} words"
+              + (f" after {kills} kills" if name == "resumed" else ""))
+        for key, value in full.items():
+            if result[key] != value:
+                print(f"{'':>10}{key} differs: {result[key]} instead of {value}")
+        print(f"{name} matches the full crawl: {result == full}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--politeness", type=float, default=0.02)
+    parser.add_argument("--kills", type=int, default=2)
+    parser.add_argument("--kill_after", type=float, default=2.0)
+    add_site_arguments(parser)
+    parser.set_defaults( # deterministic, and small enough to finish
+        hosts=4, pages_per_host=150, links_per_page=8, error_rate=0.0,
+        redirect_rate=0.0, not_found_rate=0.0, trap_rate=0.0, latency=0.01,
+        jitter=0.0)
+    main(parser.parse_args())
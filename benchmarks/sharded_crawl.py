@@ -0,0 +1,97 @@
+"""
+Sharded crawl of the offline cache server stand-in on one machine.
+
+    python -m benchmarks.sharded_crawl [--shards 3] [--threads 2] [--pages_per_host 100] ...
+
+Starts benchmarks.cache_server, writes a config for its synthetic site into a
+scratch directory and runs `launch.py --restart --shards N --local_cache`
+there, so the shard processes, link forwarding and the report merge all run
+for real. Then it checks that no host was crawled by two shards and that the
+merged report adds up to the shard reports.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from argparse import ArgumentParser
+from configparser import ConfigParser
+from urllib.parse import urlparse
+
+from benchmarks.cache_server import add_site_arguments, site_from_args
+from benchmarks.crawl_throughput import REPO_DIR, start_server
+
+
+def write_config(args, site, path):
+    cparser = ConfigParser()
+    cparser.read(os.path.join(REPO_DIR, args.config_file))
+    cparser["CRAWLER"]["SEEDURL"] = ",".join(site.seed_urls)
+    cparser["CRAWLER"]["POLITENESS"] = str(args.politeness)
+    cparser["LOCAL PROPERTIES"]["SAVE"] = "frontier.shelve"
+    cparser["LOCAL PROPERTIES"]["THREADCOUNT"] = str(args.threads)
+    if not cparser.has_section("SHARDS"):
+        cparser.add_section("SHARDS")
+    cparser["SHARDS"]["PEERS"] = ""
+    cparser["SHARDS"]["BASEPORT"] = str(args.base_port)
+    cparser["SHARDS"]["FLUSHINTERVAL"] = "0.2"
+    cparser["SHARDS"]["IDLE"] = str(args.idle)
+    with open(path, "w") as f:
+        cparser.write(f)
+
+
+def load_state(report_dir):
+    with open(os.path.join(report_dir, "report_state.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(args):
+    site = site_from_args(args)
+    server, port = start_server(args)
+    scratch = tempfile.mkdtemp(prefix="sharded_crawl_")
+    config_file = os.path.join(scratch, "config.ini")
+    write_config(args, site, config_file)
+    try:
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, os.path.join(REPO_DIR, "launch.py"), "--restart",
+             "--config_file", config_file, "--shards", str(args.shards),
+             "--local_cache", f"127.0.0.1:{port}"],
+            cwd=scratch, check=True,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"scratch dir: {scratch}")
+    owners = dict() # host -> shards that crawled it
+    pages = 0
+    for shard in range(args.shards):
+        state = load_state(os.path.join(scratch, "report", f"shard{shard}"))
+        hosts = {urlparse(url).hostname for url in state["unique_pages"]}
+        for host in hosts:
+            owners.setdefault(host, set()).add(shard)
+        pages += len(state["unique_pages"])
+        print(f"shard {shard}: {len(state['unique_pages'])} pages from {len(hosts)} hosts")
+    merged = load_state(os.path.join(scratch, "report"))
+    shared = sorted(host for host, shards in owners.items() if len(shards) > 1)
+    print(f"merged: {len(merged['unique_pages'])} pages from "
+          f"{len(merged['subdomain_counts'])} subdomains in {elapsed:.1f}s "
+          f"(idle wait of {args.idle}s included)")
+    print(f"hosts crawled by more than one shard: {shared or 'none'}")
+    print(f"merged pages match shard total: {len(merged['unique_pages']) == pages}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--shards", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=2)
+    parser.add_argument("--politeness", type=float, default=0.05)
+    parser.add_argument("--base_port", type=int, default=9100)
+    parser.add_argument("--idle", type=float, default=3.0)
+    add_site_arguments(parser)
+    parser.set_defaults(pages_per_host=100, trap_rate=0.0) # small enough to finish
+    main(parser.parse_args())
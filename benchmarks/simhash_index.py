@@ -0,0 +1,110 @@
+"""
+Measure SimhashIndex lookup cost as the number of fingerprints grows.
+
+    python -m benchmarks.simhash_index [--sizes 10000,100000,300000] [--distance 3]
+                                       [--sources random,pages]
+
+Two sources of fingerprints are measured:
+    random -- uniform random 64-bit values, which spread evenly over the band
+              tables (the best case for banded lookups)
+    pages  -- simhash() of synthetic pages from benchmarks.cache_server, whose
+              topics are drawn from one shared vocabulary, so fingerprints
+              cluster and some band values are far more common than others
+For each size the index is filled with that many fingerprints, then timed on
+lookups of fresh fingerprints from the same source (misses) and of stored
+fingerprints with `distance` bits flipped (hits). The average number of
+candidates a miss compares against, and the largest band bucket, show how
+evenly the band tables are used. A linear scan over the same fingerprints is
+timed for comparison.
+"""
+import random
+import time
+
+from argparse import ArgumentParser
+from collections import Counter
+
+from benchmarks.cache_server import SyntheticSite
+from utils.simhash import SimhashIndex, simhash
+
+QUERIES = 2000
+LINEAR_QUERIES = 20
+
+
+def random_fingerprints(count, rng):
+    return [rng.getrandbits(64) for _ in range(count)]
+
+
+def page_fingerprints(count, rng):
+    site = SyntheticSite()
+    return [simhash(Counter(site.page_words(rng))) for _ in range(count)]
+
+
+SOURCES = {"random": random_fingerprints, "pages": page_fingerprints}
+
+
+def flip_bits(fingerprint, count, rng):
+    for bit in rng.sample(range(64), count):
+        fingerprint ^= 1 << bit
+    return fingerprint
+
+
+def time_per_query(lookup, queries):
+    start = time.perf_counter()
+    for query in queries:
+        lookup(query)
+    return (time.perf_counter() - start) / len(queries)
+
+
+def candidates(index, fingerprint):
+    ''' How many stored fingerprints find_near compares fingerprint against. '''
+    return sum(
+        len(table.get((fingerprint >> shift) & mask, ()))
+        for (shift, mask), table in zip(index.bands, index.tables))
+
+
+def main(sizes, distance, sources):
+    print(f"max distance {distance}, {distance + 1} bands")
+    for source in sources:
+        rng = random.Random(0)
+        start = time.perf_counter()
+        pool = SOURCES[source](max(sizes) + QUERIES, rng)
+        print(f"{source}: {len(pool)} fingerprints generated in "
+              f"{time.perf_counter() - start:.1f}s, {len(set(pool))} distinct")
+        misses = pool[-QUERIES:] # never indexed
+        for size in sizes:
+            index = SimhashIndex(distance)
+            start = time.perf_counter()
+            for fingerprint in pool[:size]:
+                index.add(fingerprint)
+            build = time.perf_counter() - start
+
+            hits = [
+                flip_bits(index.fingerprints[rng.randrange(size)], distance, rng)
+                for _ in range(QUERIES)]
+            found = sum(index.find_near(query) is not None for query in hits)
+            near_misses = sum(index.find_near(query) is not None for query in misses)
+            miss_time = time_per_query(index.find_near, misses)
+            hit_time = time_per_query(index.find_near, hits)
+            compared = sum(candidates(index, query) for query in misses) / QUERIES
+            largest = max(len(bucket) for table in index.tables for bucket in table.values())
+
+            stored = index.fingerprints
+            linear = lambda query: next(
+                (fp for fp in stored if (fp ^ query).bit_count() <= distance), None)
+            linear_time = time_per_query(linear, misses[:LINEAR_QUERIES])
+            print(
+                f"{size:>9} fingerprints: build {build:.2f}s, "
+                f"miss {miss_time * 1e6:.1f}us ({compared:.1f} candidates, "
+                f"{near_misses} within distance), hit {hit_time * 1e6:.1f}us "
+                f"({found}/{QUERIES} found), largest bucket {largest}, "
+                f"linear scan {linear_time * 1e3:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--sizes", type=str, default="10000,100000,300000")
+    parser.add_argument("--distance", type=int, default=3)
+    parser.add_argument("--sources", type=str, default="random,pages")
+    args = parser.parse_args()
+    main([int(size) for size in args.sizes.split(",")], args.distance,
+         args.sources.split(","))
@@ -1,12 +1,19 @@
-from utils import get_logger
+from utils import get_logger, configure_logging
+from utils.stats import STATS
+import scraper
 from crawler.frontier import Frontier
 from crawler.worker import Worker
 
 class Crawler(object):
     def __init__(self, config, restart, frontier_factory=Frontier, worker_factory=Worker):
         self.config = config
+        configure_logging(config)
         self.logger = get_logger("CRAWLER")
+        STATS.configure(config)
+        scraper.configure(config, restart)
         self.frontier = frontier_factory(config, restart)
+        self.frontier.checkpoint_hooks.append(scraper.save_state) # scraper state is saved with the frontier
+        self.frontier.commit_hooks.append(scraper.commit_state)
         self.workers = list()
         self.worker_factory = worker_factory
 
@@ -22,5 +29,10 @@ class Crawler(object):
         self.join()
 
     def join(self):
-        for worker in self.workers:
-            worker.join()
+        try:
+            for worker in self.workers:
+                worker.join()
+        finally:
+            self.frontier.close()
+            scraper.close() # final rewrite of the report files
+            STATS.dump()
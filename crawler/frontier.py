@@ -1,72 +1,483 @@
 import os
+import sys
+import dbm
 import shelve
+import time
+import heapq
 
-from threading import Thread, RLock
+from itertools import count
+from threading import Thread, RLock, Condition
 from queue import Queue, Empty
+from utils import get_logger
+from utils.canonical import canonicalize
+from scraper import is_valid, admit_url, is_trap, template_low_info, host_yield
+from crawler.journal import Journal
+from crawler.seen import BloomFilter
+from crawler.rate import HostRateController
+from crawler.priority import get_priority
+from crawler.spill import SpillStore
+from utils.stats import STATS
+
+# Sync the shelve and truncate the journal after this many committed records.
+CHECKPOINT_RECORDS = 10000
+# Once more than HOTURLS urls are queued in memory, the worst urls of the
+# largest host queues are spilled until this share of HOTURLS is left, in
+# blocks of at most SPILL_BLOCK urls (which are also the refill batches).
+SPILL_TARGET = 0.75
+SPILL_BLOCK = 4096
+ENTRY_BYTES = 140 # memory of a queue entry besides its url string (tuple, float, ints)
+# Files a shelve at a path may be stored in, depending on the dbm module
+# (dbm.dumb, the fallback, writes .dat, .dir and .bak next to the path).
+DBM_SUFFIXES = ("", ".db", ".pag", ".dat", ".dir", ".bak")
+
+
+def dbm_files(path):
+    ''' The files that hold the shelve at path, whichever dbm module wrote it. '''
+    return [path + suffix for suffix in DBM_SUFFIXES if os.path.exists(path + suffix)]
+
+
+def restore_dumb_index(path):
+    '''
+    dbm.dumb (what shelve falls back to when no other dbm module is built)
+    rewrites its whole index on every delete and sync: the old index is
+    renamed to <path>.bak, then <path>.dir is written anew. A crash in
+    between leaves the index missing or cut short, which would silently
+    drop keys on open. Put the backup back in that case; it is complete,
+    and at most still holds the one key that was being deleted.
+    Returns True if the index was restored.
+    '''
+    dir_file, bak_file = f"{path}.dir", f"{path}.bak"
+    if not os.path.exists(bak_file) or not os.path.exists(f"{path}.dat"):
+        return False
+    with open(bak_file, "rb") as f:
+        backup_keys = f.read().count(b"\n")
+    index = b""
+    if os.path.exists(dir_file):
+        with open(dir_file, "rb") as f:
+            index = f.read()
+    # A finished rewrite ends with a newline and lost at most one key.
+    if index.endswith(b"\n") and index.count(b"\n") >= backup_keys - 1:
+        return False
+    if not index and backup_keys <= 1 and os.path.exists(dir_file):
+        return False # the last key was deleted
+    os.replace(bak_file, dir_file)
+    return True
 
-from utils import get_logger, get_urlhash, normalize
-from scraper import is_valid
 
 class Frontier(object):
     def __init__(self, config, restart):
         self.logger = get_logger("FRONTIER")
         self.config = config
-        self.to_be_downloaded = list() # initialize the todo list of URLs
-        
-        if not os.path.exists(self.config.save_file) and not restart:
+        # Politeness scheduler: one priority queue of URLs per host, plus a
+        # heap of (ready_time, host) entries for hosts that have pending URLs
+        # and no fetch in flight. Once its time has come a host moves to a
+        # heap of (host_score, host) ordered by the priority policy (see
+        # crawler/priority.py), and the best one is served. A host leaves the
+        # heaps when one of its URLs is handed out and comes back when the
+        # fetch is reported, once its adaptive delay (see crawler/rate.py)
+        # has passed.
+        self.priority = get_priority(config.priority)
+        self.host_queues = dict() # host -> heap of (score, seq, url, depth)
+        self.host_ready_at = dict() # host -> earliest time it may be hit again
+        self.hosts_in_flight = dict() # host -> url handed out whose fetch is not reported yet
+        self.ready_hosts = list() # heap of (ready_time, host)
+        self.best_hosts = list() # heap of (host_score, host), hosts ready now
+        self.best_host_score = dict() # host -> its current entry in best_hosts
+        # Pages handed out and not yet completed (url -> depth). The crawl is
+        # only over once nothing is queued and this is empty, since any of
+        # these pages may still add links.
+        self.in_flight = dict()
+        self.push_order = count() # ties between equal scores go first-in first-out
+        # Hot window: at most config.hot_urls queued urls are kept in memory
+        # (0 for no limit), the rest wait in compressed segment files.
+        self.spill = SpillStore(f"{self.config.save_file}.spill")
+        self.resident = 0 # urls in host_queues
+        self.resident_bytes = 0 # estimated memory of those
+        self.spilled = 0 # urls moved to disk so far
+        self.refilled = 0 # urls moved back so far
+        self.last_rates = (time.time(), 0, 0) # for spill and refill rates
+        STATS.gauge("frontier", self.queue_stats)
+        self.rates = HostRateController(
+            config.time_delay, config.max_time_delay, config.delay_factor,
+            config.cooldown_failures, config.cooldown)
+        self.tbd_count = 0 # how many URLs are waiting across all hosts
+        self.lock = RLock()
+        self.host_ready = Condition(self.lock)
+        self.journal_file = f"{self.config.save_file}.journal"
+        self.seen_file = f"{self.config.save_file}.seen"
+        self.pending_file = f"{self.config.save_file}.pending"
+        self.checkpoint_hooks = list() # callables that persist state kept next to the save file
+        self.commit_hooks = list() # callables run before each journal commit
+
+        save_files = dbm_files(self.config.save_file)
+        if not save_files and not restart:
             # Save file does not exist, but request to load save.
             self.logger.info(
                 f"Did not find save file {self.config.save_file}, "
                 f"starting from seed.")
-        elif os.path.exists(self.config.save_file) and restart:
+        elif save_files and restart:
             # Save file does exists, but request to start from seed.
             self.logger.info(
                 f"Found save file {self.config.save_file}, deleting it.")
-            os.remove(self.config.save_file)
+            for path in save_files:
+                os.remove(path)
+        if restart:
+            for path in (self.journal_file, self.seen_file):
+                if os.path.exists(path):
+                    os.remove(path)
+        if not restart:
+            for path in (self.config.save_file, self.pending_file):
+                if restore_dumb_index(path):
+                    self.logger.warning(
+                        f"Restored the index of {path} from its backup, "
+                        f"it was cut short by a crash.")
         # Load existing save file, or create one if it does not exist.
         self.save = shelve.open(self.config.save_file)
+        # Pending table: urlhash -> url for every discovered, not yet completed
+        # url, so a resume never has to scan the whole save file.
+        legacy_save = not restart and dbm.whichdb(self.pending_file) is None
+        self.pending = shelve.open(self.pending_file, "n" if restart else "c")
+        if legacy_save:
+            self._build_pending()
+        self._load_seen()
+        self._replay_journal() # recover changes committed after the last checkpoint
+        self.journal = Journal(
+            self.journal_file, self.config.commit_batch,
+            self.config.commit_window)
         if restart:
-            for url in self.config.seed_urls:
-                self.add_url(url) # if restarting, add each seed to the frontier
+            self.add_urls(self.config.seed_urls) # if restarting, add each seed to the frontier
         else:
             # Set the frontier state with contents of save file.
             self._parse_save_file()
             if not self.save: # If the save is empty, fall back to seeding
-                for url in self.config.seed_urls:
-                    self.add_url(url)
+                self.add_urls(self.config.seed_urls)
 
     def _parse_save_file(self):
-        ''' This function can be overridden for alternate saving techniques. '''
-        total_count = len(self.save) # how many URLs hav been discovered 
-        tbd_count = 0 # how many are still pending 
-        for url, completed in self.save.values():
-            if not completed and is_valid(url):
-                self.to_be_downloaded.append(url) # add to todolist
+        ''' This function can be overridden for alternate saving techniques.
+        Only the pending table is read; urls are revalidated lazily when
+        they are handed out by get_tbd_url. '''
+        total_count = len(self.save) # how many URLs hav been discovered
+        tbd_count = 0 # how many are still pending
+        with self.lock:
+            for entry in self.pending.values():
+                # (url, depth, referrer novelty), or just the url when the
+                # depth is unknown (older save files, journal replays).
+                url, depth, novelty = (entry, 0, 1.0) if isinstance(entry, str) else entry
+                self._push(url, depth, novelty) # add to todolist
                 tbd_count += 1
         self.logger.info(
             f"Found {tbd_count} urls to be downloaded from {total_count} "
             f"total urls discovered.")
 
-    def get_tbd_url(self):
-        try:
-            return self.to_be_downloaded.pop() # frontier uses stack; if empty, return None; Workers stop when None is returned
-        except IndexError:
-            return None
+    def _build_pending(self):
+        ''' One-time full scan for save files written before the pending
+        table existed. '''
+        for urlhash, (url, completed) in self.save.items():
+            if not completed:
+                self.pending[urlhash] = url
+        self.pending.sync()
+        self.logger.info(
+            f"Built pending table {self.pending_file} from "
+            f"{self.config.save_file}.")
+
+    def _load_seen(self):
+        ''' Load the in-memory seen-set saved at the last checkpoint, or
+        rebuild it from the shelve keys if it is missing. '''
+        self.seen = BloomFilter.load(self.seen_file)
+        if self.seen is None:
+            self.seen = BloomFilter(self.config.expected_urls)
+            for urlhash in self.save.keys():
+                self.seen.add(urlhash)
+            if self.seen.count:
+                self.logger.info(
+                    f"Rebuilt seen-set from {self.config.save_file}.")
+        self.logger.info(f"Seen-set: {self.seen.memory_report()}.")
+
+    def _replay_journal(self):
+        ''' Apply journaled changes left over from a crash to the shelve. '''
+        replayed = 0
+        for url, completed in Journal.replay(self.journal_file):
+            urlhash = canonicalize(url).urlhash
+            # The seen-set on disk predates the journal, so every journaled
+            # url is new to it, whether it was completed or only queued.
+            if urlhash not in self.seen:
+                self.seen.add(urlhash)
+            if completed:
+                self.save[urlhash] = (url, True)
+                self.pending.pop(urlhash, None)
+            elif urlhash not in self.save:
+                self.save[urlhash] = (url, False)
+                self.pending[urlhash] = url
+            replayed += 1
+        if replayed:
+            self.save.sync()
+            self.pending.sync()
+            self.logger.info(
+                f"Replayed {replayed} journal records into "
+                f"{self.config.save_file}.")
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+
+    def _maybe_commit(self):
+        ''' Group commit the journal if due. Caller must hold self.lock. '''
+        if self.journal.commit_due():
+            for hook in self.commit_hooks:
+                hook()
+            self.journal.commit()
+            if self.journal.size >= CHECKPOINT_RECORDS:
+                self._checkpoint()
+
+    def _checkpoint(self):
+        ''' Make the shelve durable so the journal can start over. '''
+        self.save.sync()
+        self.pending.sync()
+        self.seen.save(self.seen_file)
+        self.journal.truncate()
+        for hook in self.checkpoint_hooks:
+            hook()
+        self.logger.info(
+            f"Checkpoint. Seen-set: {self.seen.memory_report()}. "
+            f"Queue: {self.memory_report()}.")
+
+    def memory_report(self):
+        return (
+            f"{self.resident} urls in memory (~{self.resident_bytes / 2**20:.1f} MiB), "
+            f"{self.spill.urls} on disk in {self.spill.bytes / 2**20:.1f} MiB, "
+            f"{self.spilled} spilled and {self.refilled} refilled so far")
+
+    def queue_stats(self):
+        ''' Hot window figures for the stats file, with spill and refill
+        rates (urls per second) since the previous call. '''
+        with self.lock:
+            now = time.time()
+            last_time, last_spilled, last_refilled = self.last_rates
+            elapsed = max(now - last_time, 1e-9)
+            self.last_rates = (now, self.spilled, self.refilled)
+            return {
+                "resident_urls": self.resident,
+                "resident_bytes": self.resident_bytes,
+                "spilled_urls": self.spill.urls,
+                "spill_bytes": self.spill.bytes,
+                "spill_rate": round((self.spilled - last_spilled) / elapsed, 3),
+                "refill_rate": round((self.refilled - last_refilled) / elapsed, 3)}
+
+    def _push(self, url, depth, novelty):
+        ''' Score url and queue it under its host. Caller must hold self.lock. '''
+        host = canonicalize(url).host
+        score = self.priority.score(depth, template_low_info(url), novelty)
+        queue = self.host_queues.get(host)
+        if queue is None:
+            queue = self.host_queues[host] = list()
+        if not queue and host not in self.hosts_in_flight:
+            # Host had nothing pending, so it is not in the heaps yet.
+            heapq.heappush(self.ready_hosts, (self.host_ready_at.get(host, 0), host))
+            self.host_ready.notify()
+        elif host in self.best_host_score and score < queue[0][0]:
+            self._make_best(host, score) # its turn among the ready hosts moves up
+        heapq.heappush(queue, (score, next(self.push_order), url, depth))
+        self.resident += 1
+        self.resident_bytes += ENTRY_BYTES + sys.getsizeof(url)
+        self.tbd_count += 1
+        if self.config.hot_urls and self.resident > self.config.hot_urls:
+            self._spill()
+
+    def _spill(self):
+        ''' Move the worst half of the largest host queues to disk until the
+        hot window is back under its target. The best urls of each host stay
+        in memory, so a host queue is never emptied by a spill. Caller must
+        hold self.lock. '''
+        target = self.config.hot_urls * SPILL_TARGET
+        while self.resident > target:
+            host = max(self.host_queues, key=lambda host: len(self.host_queues[host]))
+            entries = sorted(self.host_queues[host])
+            keep = (len(entries) + 1) // 2
+            if keep == len(entries):
+                break # every host is down to one url
+            self.host_queues[host] = entries[:keep] # a sorted list is a heap
+            for start in range(keep, len(entries), SPILL_BLOCK):
+                block = entries[start:start + SPILL_BLOCK]
+                self.spill.spill(host, [(score, url, depth) for score, _, url, depth in block])
+                self.resident -= len(block)
+                self.resident_bytes -= sum(ENTRY_BYTES + sys.getsizeof(entry[2]) for entry in block)
+                self.spilled += len(block)
+                STATS.count("frontier.spilled", len(block))
+
+    def _refill(self, host):
+        ''' Move the best spilled block of host back into its queue. Caller
+        must hold self.lock. '''
+        queue = self.host_queues[host]
+        entries = self.spill.refill(host)
+        for score, url, depth in entries:
+            heapq.heappush(queue, (score, next(self.push_order), url, depth))
+            self.resident_bytes += ENTRY_BYTES + sys.getsizeof(url)
+        self.resident += len(entries)
+        self.refilled += len(entries)
+        STATS.count("frontier.refilled", len(entries))
+
+    def _make_best(self, host, url_score):
+        ''' (Re)enter a ready host in best_hosts; older entries of the host
+        are skipped when popped. Caller must hold self.lock. '''
+        host_score = self.priority.host_score(url_score, host_yield(host))
+        self.best_host_score[host] = host_score
+        heapq.heappush(self.best_hosts, (host_score, host))
+
+    def get_tbd_url(self, wait=True, timeout=None):
+        ''' Return the next URL whose host is ready, from whichever host is
+        best; threads are not tied to hosts. With wait, blocks while every
+        host with pending URLs was hit too recently or is being fetched, and
+        while other pages are still being processed (they may add links),
+        for at most timeout seconds if given. Returns None if no URL is
+        available; done() tells whether the crawl is over. The caller must
+        report the fetch with report_fetch() and finish the page with
+        mark_url_complete(). '''
+        deadline = None if timeout is None else time.time() + timeout
+        with self.lock:
+            while True:
+                now = time.time()
+                while self.ready_hosts and self.ready_hosts[0][0] <= now:
+                    _, host = heapq.heappop(self.ready_hosts)
+                    self._make_best(host, self.host_queues[host][0][0])
+                if self.best_hosts:
+                    host_score, host = heapq.heappop(self.best_hosts)
+                    if self.best_host_score.get(host) != host_score:
+                        continue # superseded by a better entry
+                    del self.best_host_score[host]
+                    queue = self.host_queues[host]
+                    if host in self.spill and self.spill.best_score(host) < queue[0][0]:
+                        self._refill(host) # urls queued since the spill ran out first
+                    _, _, url, depth = heapq.heappop(queue)
+                    self.resident -= 1
+                    self.resident_bytes -= ENTRY_BYTES + sys.getsizeof(url)
+                    self.tbd_count -= 1
+                    if not queue and host in self.spill:
+                        self._refill(host)
+                    if not is_valid(url) or is_trap(url):
+                        # Resumed urls are revalidated here rather than at startup,
+                        # and urls whose template turned out to be a trap are skipped.
+                        self._retire(canonicalize(url).urlhash, url)
+                        self._maybe_commit()
+                        self._requeue_host(host)
+                        continue
+                    self.hosts_in_flight[host] = url
+                    self.in_flight[url] = depth
+                    if not self.host_queues[host]:
+                        del self.host_queues[host]
+                    return url
+                if not wait or self._drained():
+                    return None
+                # Sleep until the next host is due; wake up early if a url
+                # is queued, a fetch is reported or the last page completes.
+                sleep = self.ready_hosts[0][0] - now if self.ready_hosts else None
+                if deadline is not None:
+                    if now >= deadline:
+                        return None
+                    sleep = deadline - now if sleep is None else min(sleep, deadline - now)
+                self.host_ready.wait(sleep)
+
+    def done(self):
+        ''' True once the crawl is over: nothing is queued and no page is
+        being processed. '''
+        with self.lock:
+            return self._drained()
+
+    def _drained(self):
+        return not self.tbd_count and not self.in_flight
+
+    def report_fetch(self, url, status, latency):
+        ''' Record how the download of url went (status, seconds) and let
+        its host back into the schedule after its adaptive delay. Only the
+        first report of a url counts. '''
+        host = canonicalize(url).host
+        with self.lock:
+            if self.hosts_in_flight.get(host) != url:
+                return # already reported
+            del self.hosts_in_flight[host]
+            ready_time = self.host_ready_at[host] = self.rates.record(host, status, latency)
+            if self.rates.in_cooldown(host):
+                STATS.count("host.cooldown")
+                self.logger.warning(
+                    f"Host {host} keeps failing (last status {status}), "
+                    f"pausing it for {self.config.cooldown} seconds.")
+            if self.host_queues.get(host):
+                heapq.heappush(self.ready_hosts, (ready_time, host))
+            self.host_ready.notify_all() # also wakes waiters when nothing is left
+
+    def _requeue_host(self, host):
+        ''' Put a ready host back in best_hosts if it still has urls.
+        Caller must hold self.lock. '''
+        if self.host_queues[host]:
+            self._make_best(host, self.host_queues[host][0][0])
+        else:
+            del self.host_queues[host]
 
     def add_url(self, url):
-        url = normalize(url) # normalize so same page doesn't appear in multiple forms
-        urlhash = get_urlhash(url) # compute hash key for storage
-        if urlhash not in self.save:
-            self.save[urlhash] = (url, False) # store hash key as not completed yet
-            self.save.sync() # flush to disk immediately
-            self.to_be_downloaded.append(url) # add to todo list for Workers
-    
+        self.add_urls([url])
+
+    def add_urls(self, urls, referrer=None):
+        ''' Add a batch of urls (e.g. every link on a page) with one lock
+        acquisition and one journal commit check. referrer is the page they
+        were found on (None for seeds), which gives their depth. Returns the
+        urls that were new to the frontier. '''
+        with self.lock:
+            depth = self.in_flight[referrer] + 1 if referrer in self.in_flight else 0
+        return self._add_batch(urls, depth)
+
+    def _add_batch(self, urls, depth):
+        batch = dict()
+        for url in urls:
+            url = canonicalize(url) # so the same page doesn't appear in multiple forms
+            batch.setdefault(url.urlhash, url.url) # dedupe the batch in memory first
+        added = list()
+        with self.lock:
+            for urlhash, url in batch.items():
+                if urlhash in self.seen and urlhash in self.save:
+                    continue # shelve is only read when the seen-set may have it
+                if not admit_url(url):
+                    continue # its url template is over budget or low-info
+                added.append((urlhash, url))
+            # A page whose links were mostly seen before is in well-trodden
+            # territory; the links it did add are less likely to be new too.
+            novelty = len(added) / len(batch) if batch else 1.0
+            for urlhash, url in added:
+                self.seen.add(urlhash)
+                self.save[urlhash] = (url, False) # store hash key as not completed yet
+                self.pending[urlhash] = (url, depth, novelty)
+                self.journal.append(url, False) # durable once the journal group commits
+                self._push(url, depth, novelty) # add to todo list for Workers
+            self._maybe_commit()
+        return [url for _, url in added]
+
     def mark_url_complete(self, url):
-        urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            # This should not happen.
-            self.logger.error(
-                f"Completed url {url}, but have not seen it before.")
+        canonical = canonicalize(url)
+        urlhash = canonical.urlhash
+        with self.lock:
+            if self.hosts_in_flight.get(canonical.host) == url:
+                # Its fetch was never reported (the worker failed), which
+                # would keep the host out of the schedule for good.
+                self.report_fetch(url, 0, None)
+            if urlhash not in self.save:
+                # This should not happen.
+                self.logger.error(
+                    f"Completed url {url}, but have not seen it before.")
+
+            self._retire(urlhash, url)
+            self.in_flight.pop(url, None)
+            if not self.in_flight:
+                self.host_ready.notify_all() # waiters may be able to stop now
+            self._maybe_commit()
 
+    def _retire(self, urlhash, url):
+        ''' Mark url done for good, fetched or rejected, so a resume does
+        not load it again. Caller must hold self.lock. '''
         self.save[urlhash] = (url, True) # update status to completed
-        self.save.sync() # flush to disk
+        self.pending.pop(urlhash, None)
+        self.journal.append(url, True)
+
+    def close(self):
+        ''' Commit outstanding changes and close the save file. '''
+        with self.lock:
+            self._checkpoint()
+            self.journal.close()
+            self.save.close()
+            self.pending.close()
+            self.spill.close()
@@ -0,0 +1,62 @@
+import os
+import time
+
+
+class Journal(object):
+    """
+    Append-only log of frontier state changes.
+    Each record is one line "<completed>\t<url>". Records are buffered and
+    written + fsynced as a group once batch_size records are waiting or
+    window seconds have passed since the last commit, so a crash loses at
+    most one group. The shelve only needs to be synced at checkpoints; on
+    startup the journal is replayed on top of it.
+    """
+    def __init__(self, path, batch_size, window):
+        self.path = path
+        self.batch_size = batch_size
+        self.window = window
+        self.buffer = list() # records waiting for the next group commit
+        self.size = 0 # records committed since the last checkpoint
+        self.last_commit = time.time()
+        self.file = open(path, "a", encoding="utf-8")
+
+    @staticmethod
+    def replay(path):
+        ''' Yield (url, completed) for every complete record in the journal. '''
+        if not os.path.exists(path):
+            return
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break # torn write from a crash, nothing after it was committed
+                completed, _, url = line.rstrip("\n").partition("\t")
+                if url:
+                    yield url, completed == "1"
+
+    def append(self, url, completed):
+        self.buffer.append(f"{int(completed)}\t{url}\n")
+
+    def commit_due(self):
+        return bool(self.buffer) and (
+            len(self.buffer) >= self.batch_size
+            or time.time() - self.last_commit >= self.window)
+
+    def commit(self):
+        if self.buffer:
+            self.file.write("".join(self.buffer))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.size += len(self.buffer)
+            self.buffer.clear()
+        self.last_commit = time.time()
+
+    def truncate(self):
+        ''' Drop all records once the shelve has been synced. '''
+        self.buffer.clear()
+        self.file.truncate(0)
+        self.size = 0
+        self.last_commit = time.time()
+
+    def close(self):
+        self.commit()
+        self.file.close()
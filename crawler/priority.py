@@ -0,0 +1,50 @@
+import math
+
+
+class BestFirst(object):
+    """
+    Order in which queued urls are fetched; lower scores go first.
+    A url is scored once, when it is queued, from its depth below the seeds,
+    the low-info share of its url template so far (see utils/traps.py) and
+    the novelty of the page that linked to it (the share of that page's
+    links that were new to the frontier). Among the hosts that are ready, a
+    host's turn comes from its best url's score plus a penalty that grows
+    with the pages the host has already yielded, so a few large hosts do not
+    crowd out the subdomains that have barely been crawled.
+
+    Subclass and override score() and host_score() for another policy, and
+    register it in PRIORITIES so the PRIORITY option can select it.
+    """
+    depth_weight = 1.0
+    template_weight = 4.0
+    novelty_weight = 2.0
+    host_weight = 0.5 # per doubling of the host's pages
+
+    def score(self, depth, template_low_info, referrer_novelty):
+        ''' depth is 0 for seeds; template_low_info and referrer_novelty
+        are between 0 and 1. '''
+        return (
+            self.depth_weight * depth
+            + self.template_weight * template_low_info
+            + self.novelty_weight * (1.0 - referrer_novelty))
+
+    def host_score(self, url_score, host_pages):
+        return url_score + self.host_weight * math.log2(1 + host_pages)
+
+
+class BreadthFirst(BestFirst):
+    """ Plain breadth-first order: by depth, then in the order queued. """
+    template_weight = 0.0
+    novelty_weight = 0.0
+    host_weight = 0.0
+
+
+PRIORITIES = {"best_first": BestFirst, "breadth_first": BreadthFirst}
+
+
+def get_priority(name):
+    ''' Return the priority policy for a name from config.ini. '''
+    if name not in PRIORITIES:
+        raise ValueError(
+            f"Unknown priority {name!r}, expected one of {sorted(PRIORITIES)}.")
+    return PRIORITIES[name]()
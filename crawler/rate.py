@@ -0,0 +1,68 @@
+import time
+
+LATENCY_WEIGHT = 0.3 # weight of the newest sample in the latency average
+RECOVERY = 0.75 # after a success the delay shrinks by this factor towards its floor
+
+
+def is_failure(status):
+    ''' Statuses that suggest the host (or the cache in front of it) is
+    struggling: no response at all, 429, 5xx and the cache's 6xx. '''
+    return status == 0 or status == 429 or 500 <= status < 700
+
+
+class HostRate(object):
+    __slots__ = ("latency", "delay", "failures", "cooldown_until")
+
+    def __init__(self, delay):
+        self.latency = None # moving average of download seconds
+        self.delay = delay
+        self.failures = 0 # consecutive failures
+        self.cooldown_until = 0.0
+
+
+class HostRateController(object):
+    """
+    Per-host politeness delay driven by the fetches the workers report.
+    A healthy host is hit every max(min_delay, delay_factor * latency)
+    seconds, never faster than min_delay (POLITENESS). Each failure doubles
+    its delay up to max_delay, and after cooldown_failures failures in a row
+    the host is paused for cooldown seconds. Successes bring the delay back
+    down gradually. Not thread safe; the frontier calls it under its lock.
+    """
+    def __init__(self, min_delay, max_delay, delay_factor, cooldown_failures, cooldown):
+        self.min_delay = min_delay
+        self.max_delay = max(max_delay, min_delay)
+        self.delay_factor = delay_factor
+        self.cooldown_failures = cooldown_failures
+        self.cooldown = cooldown
+        self.hosts = dict() # host -> HostRate
+
+    def record(self, host, status, latency):
+        ''' Update host with one fetch and return the time (epoch seconds)
+        at which it may be hit again. '''
+        rate = self.hosts.get(host)
+        if rate is None:
+            rate = self.hosts[host] = HostRate(self.min_delay)
+        if latency is not None:
+            rate.latency = latency if rate.latency is None else (
+                LATENCY_WEIGHT * latency + (1 - LATENCY_WEIGHT) * rate.latency)
+        floor = self.min_delay
+        if rate.latency is not None:
+            floor = min(self.max_delay, max(floor, self.delay_factor * rate.latency))
+
+        now = time.time()
+        if is_failure(status):
+            rate.failures += 1
+            rate.delay = min(self.max_delay, max(floor, rate.delay * 2))
+            if self.cooldown_failures and rate.failures >= self.cooldown_failures:
+                rate.failures = 0 # give it a fresh run of attempts after the pause
+                rate.cooldown_until = now + self.cooldown
+                return rate.cooldown_until
+        else:
+            rate.failures = 0
+            rate.delay = max(floor, rate.delay * RECOVERY)
+        return now + rate.delay
+
+    def in_cooldown(self, host):
+        rate = self.hosts.get(host)
+        return rate is not None and rate.cooldown_until > time.time()
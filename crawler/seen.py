@@ -0,0 +1,91 @@
+import os
+import math
+import struct
+
+from utils import atomic_write
+
+HEADER = struct.Struct("<QQQQ") # num_bits, num_hashes, count, capacity
+OLD_HEADER = struct.Struct("<QQQ") # before capacity was saved
+
+
+class BloomFilter(object):
+    """
+    In-memory membership test for url hashes, kept in front of the shelve.
+    A miss is definite; a hit may be a false positive (about error_rate once
+    `capacity` urls are in), so the caller confirms hits against the shelve.
+    Keys are the hex sha256 strings from utils.get_urlhash, so no extra
+    hashing is needed: two 64-bit slices of it drive double hashing.
+    """
+    def __init__(self, capacity, error_rate=0.01, num_bits=None, num_hashes=None):
+        capacity = max(1, capacity)
+        self.capacity = capacity
+        self.num_bits = num_bits or max(
+            64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = num_hashes or max(
+            1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0 # how many urls were added
+
+    def _positions(self, urlhash):
+        h1 = int(urlhash[:16], 16)
+        h2 = int(urlhash[16:32], 16) | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, urlhash):
+        for pos in self._positions(urlhash):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, urlhash):
+        return all(
+            self.bits[pos >> 3] & (1 << (pos & 7))
+            for pos in self._positions(urlhash))
+
+    @property
+    def nbytes(self):
+        return len(self.bits) + HEADER.size
+
+    def fill_ratio(self):
+        ''' Fraction of the bits that are set. '''
+        return int.from_bytes(self.bits, "little").bit_count() / self.num_bits
+
+    def memory_report(self):
+        # The bits are allocated up front for `capacity` urls, so the size per
+        # url only means something at capacity; the fill shows how far along it is.
+        fill = self.fill_ratio()
+        return (
+            f"{self.count} of {self.capacity} urls in {self.nbytes} bytes "
+            f"({self.nbytes / self.capacity:.1f} bytes per url at capacity, "
+            f"{self.num_hashes} hashes, {fill:.1%} of bits set, "
+            f"estimated false positive rate {fill ** self.num_hashes:.4%})")
+
+    def save(self, path):
+        atomic_write(
+            path, HEADER.pack(
+                self.num_bits, self.num_hashes, self.count, self.capacity)
+            + bytes(self.bits))
+
+    @classmethod
+    def load(cls, path):
+        ''' Return the filter saved at path, or None if it is missing or torn. '''
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < OLD_HEADER.size:
+            return None
+        num_bits, num_hashes, count = OLD_HEADER.unpack_from(data)
+        if len(data) - HEADER.size == (num_bits + 7) // 8:
+            capacity = HEADER.unpack_from(data)[3]
+            bits = data[HEADER.size:]
+        elif len(data) - OLD_HEADER.size == (num_bits + 7) // 8:
+            # Saved without its capacity: num_hashes = bits per url * ln 2.
+            capacity = round(num_bits * math.log(2) / num_hashes)
+            bits = data[OLD_HEADER.size:]
+        else:
+            return None
+        bloom = cls(capacity, num_bits=num_bits, num_hashes=num_hashes)
+        bloom.bits = bytearray(bits)
+        bloom.count = count
+        return bloom
@@ -0,0 +1,302 @@
+import os
+import json
+import time
+
+from bisect import bisect
+from hashlib import blake2b
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+from threading import Thread, Lock, Event
+from crawler.frontier import Frontier
+from utils import get_logger
+from utils.canonical import canonicalize
+from utils.stats import STATS
+
+VIRTUAL_NODES = 64 # points per shard on the hash ring
+AUTHKEY_ENV = "CRAWLER_SHARD_AUTHKEY" # how launch.py --shards passes its shards their key
+
+
+def configure_shard(config, shard_id, num_shards):
+    ''' Turn config into the config of one shard: its own save file and
+    stats file, and the addresses of every shard's link listener. '''
+    config.shard_id = shard_id
+    if config.shard_peers_spec:
+        peers = [peer.strip().rsplit(":", 1) for peer in config.shard_peers_spec.split(",")]
+        assert len(peers) == num_shards, "PEERS must list one HOST:PORT per shard"
+        config.shard_peers = [(host, int(port)) for host, port in peers]
+    else:
+        config.shard_peers = [
+            ("127.0.0.1", config.shard_base_port + shard) for shard in range(num_shards)]
+    authkey = config.shard_authkey_spec or os.environ.get(AUTHKEY_ENV, "")
+    if not authkey:
+        raise ValueError(
+            "Set AUTHKEY in [SHARDS] to a secret shared by every shard "
+            "(launch.py --shards N makes one up for its own shards).")
+    config.shard_authkey = authkey.encode("utf-8")
+    root, ext = os.path.splitext(config.save_file)
+    config.save_file = f"{root}.shard{shard_id}{ext}"
+    if config.stats_file:
+        root, ext = os.path.splitext(config.stats_file)
+        config.stats_file = f"{root}.shard{shard_id}{ext}"
+
+
+def ring_hash(key):
+    return int.from_bytes(blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class ShardRing(object):
+    """
+    Consistent hashing of hostnames onto shards. Each shard owns
+    VIRTUAL_NODES points on a 64-bit ring and a host belongs to the first
+    point after its hash, so adding a shard only moves about 1/N of the hosts.
+    """
+    def __init__(self, num_shards, virtual_nodes=VIRTUAL_NODES):
+        points = sorted(
+            (ring_hash(f"shard-{shard}-{v}"), shard)
+            for shard in range(num_shards) for v in range(virtual_nodes))
+        self.hashes = [h for h, _ in points]
+        self.shards = [shard for _, shard in points]
+
+    def shard_of(self, host):
+        i = bisect(self.hashes, ring_hash(host)) % len(self.hashes)
+        return self.shards[i]
+
+
+def url_host(url):
+    return canonicalize(url).host
+
+
+class ShardRouter(object):
+    """
+    Link exchange between shards. Urls for other shards are buffered per
+    peer, with their depth, and sent in batches (every `flush_interval` seconds, or sooner once
+    `batch_size` are waiting) over multiprocessing.connection, which frames
+    the messages and only accepts peers that know the shared key. Messages
+    are JSON, never pickles, so even a peer cannot make a shard run code.
+    Batches from peers are passed to `deliver`. Unsent batches are kept and
+    retried while a peer is down.
+
+    Every tick each shard also sends its peers a status: whether it is idle
+    and how many urls it has sent and received. The crawl is over once every
+    shard is idle and all urls sent were received, twice in a row with the
+    same counts (so no message was in flight in between).
+    """
+    def __init__(self, shard_id, peers, authkey, deliver, is_idle,
+                 batch_size=100, flush_interval=1.0):
+        self.logger = get_logger(f"SHARD-{shard_id}", "Shard")
+        self.shard_id = shard_id
+        self.peers = peers # shard -> (host, port), including this shard
+        self.authkey = authkey
+        self.deliver = deliver
+        self.is_idle = is_idle
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.ring = ShardRing(len(peers))
+        self.outgoing = {shard: list() for shard in range(len(peers)) if shard != shard_id} # of (url, depth)
+        self.connections = dict() # shard -> Client connection
+        self.lock = Lock() # guards outgoing, counts and statuses
+        self.send_lock = Lock() # guards connections
+        self.wakeup = Event()
+        self.closed = False
+        self.sent = 0 # urls delivered to peers
+        self.received = 0 # urls delivered by peers
+        self.statuses = dict() # shard -> (idle, sent, received) last reported
+        self.last_snapshot = None # counts seen by the previous all_done() call
+        self.listener = None
+
+    def start(self):
+        self.listener = Listener(self.peers[self.shard_id], authkey=self.authkey)
+        Thread(target=self._accept, daemon=True, name="shard-accept").start()
+        Thread(target=self._send_loop, daemon=True, name="shard-send").start()
+
+    def split(self, urls, depth):
+        ''' Queue urls owned by other shards and return the local ones. '''
+        local = list()
+        with self.lock:
+            for url in urls:
+                shard = self.ring.shard_of(url_host(url))
+                if shard == self.shard_id:
+                    local.append(url)
+                else:
+                    self.outgoing[shard].append((url, depth))
+                    if len(self.outgoing[shard]) >= self.batch_size:
+                        self.wakeup.set()
+        return local
+
+    def all_done(self):
+        ''' True once no shard has work left and no urls are in flight. '''
+        idle = self.is_idle()
+        with self.lock:
+            statuses = [(idle and not any(self.outgoing.values()), self.sent, self.received)]
+            statuses += [self.statuses.get(shard) for shard in self.outgoing]
+            done = (
+                None not in statuses
+                and all(status[0] for status in statuses)
+                and sum(status[1] for status in statuses) == sum(status[2] for status in statuses)
+                and statuses == self.last_snapshot)
+            self.last_snapshot = statuses
+            return done
+
+    def _accept(self):
+        while not self.closed:
+            try:
+                conn = self.listener.accept()
+            except AuthenticationError:
+                self.logger.warning("Refused a peer that does not know AUTHKEY.")
+                continue
+            except OSError:
+                return # listener closed
+            Thread(target=self._receive, args=(conn,), daemon=True).start()
+
+    def _receive(self, conn):
+        with conn:
+            while True:
+                try:
+                    kind, shard, payload = json.loads(conn.recv_bytes())
+                except (EOFError, OSError):
+                    return
+                except (ValueError, TypeError):
+                    self.logger.warning("Dropped a malformed message from a peer.")
+                    return
+                if kind == "urls":
+                    self.deliver(payload)
+                    STATS.count("shard.received", len(payload))
+                    with self.lock:
+                        self.received += len(payload)
+                else: # "status"
+                    with self.lock:
+                        self.statuses[shard] = tuple(payload)
+
+    def _send_loop(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            with self.send_lock:
+                self._flush()
+                self._send_status()
+
+    def _send(self, shard, message):
+        conn = self.connections.get(shard)
+        if conn is None:
+            conn = self.connections[shard] = Client(self.peers[shard], authkey=self.authkey)
+        try:
+            conn.send_bytes(json.dumps(message).encode("utf-8"))
+        except (OSError, EOFError):
+            self.connections.pop(shard, None)
+            raise
+
+    def _flush(self):
+        ''' Send every waiting batch; peers that cannot be reached keep
+        theirs. Caller must hold send_lock. '''
+        with self.lock:
+            batches = {shard: urls for shard, urls in self.outgoing.items() if urls}
+            for shard in batches:
+                self.outgoing[shard] = list()
+        for shard, urls in batches.items():
+            try:
+                self._send(shard, ("urls", self.shard_id, urls))
+                STATS.count("shard.forwarded", len(urls))
+                with self.lock:
+                    self.sent += len(urls)
+            except (OSError, EOFError) as e:
+                self.logger.warning(
+                    f"Could not reach shard {shard} at {self.peers[shard]} ({e}), "
+                    f"keeping {len(urls)} urls for the next try.")
+                with self.lock:
+                    self.outgoing[shard][:0] = urls
+
+    def _send_status(self):
+        ''' Caller must hold send_lock. '''
+        idle = self.is_idle()
+        with self.lock:
+            status = (idle and not any(self.outgoing.values()), self.sent, self.received)
+        for shard in self.outgoing:
+            try:
+                self._send(shard, ("status", self.shard_id, status))
+            except (OSError, EOFError):
+                pass # not up yet, or already finished
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+        with self.send_lock:
+            self._flush()
+            for conn in self.connections.values():
+                conn.close()
+        if self.listener is not None:
+            self.listener.close()
+
+
+class ShardedFrontier(Frontier):
+    """
+    Frontier for one shard of a multi-process crawl (see launch.py --shards).
+    It only queues urls whose host it owns; the rest are forwarded to the
+    owning shard. As a shard can get new urls from its peers at any time, it
+    only reports itself empty once every shard is out of work (see
+    ShardRouter). A shard counts as idle after IDLE ([SHARDS]) seconds
+    without handing out a url and with nothing queued or being processed.
+    """
+    def __init__(self, config, restart):
+        # Every shard is given all the seeds, so during startup urls of other
+        # shards are simply dropped (self.router is None until then).
+        self.ring = ShardRing(len(config.shard_peers))
+        self.shard_id = config.shard_id
+        self.router = None
+        self.last_handed_out = time.time()
+        self.finished = False # every shard is out of work
+        super().__init__(config, restart)
+        self.router = ShardRouter(
+            config.shard_id, config.shard_peers, config.shard_authkey,
+            self._receive_urls, self._is_idle,
+            config.shard_batch, config.shard_flush_interval)
+        self.router.start()
+
+    def add_urls(self, urls, referrer=None):
+        with self.lock:
+            depth = self.in_flight[referrer] + 1 if referrer in self.in_flight else 0
+        if self.router is None:
+            local = [url for url in urls if self.ring.shard_of(url_host(url)) == self.shard_id]
+        else:
+            local = self.router.split(urls, depth)
+        return self._add_batch(local, depth)
+
+    def _receive_urls(self, links):
+        # peers only send urls this shard owns
+        by_depth = dict()
+        for url, depth in links:
+            by_depth.setdefault(depth, list()).append(url)
+        for depth, urls in by_depth.items():
+            self._add_batch(urls, depth)
+
+    def _is_idle(self):
+        with self.lock:
+            return (
+                self._drained()
+                and time.time() - self.last_handed_out >= self.config.shard_idle)
+
+    def get_tbd_url(self, wait=True, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            remaining = None if deadline is None else max(deadline - time.time(), 0)
+            url = super().get_tbd_url(wait, remaining)
+            if url:
+                self.last_handed_out = time.time()
+                return url
+            if not wait or self.finished or not super().done():
+                return None # timed out with work left here
+            if self.router.all_done():
+                self.finished = True
+                return None
+            if deadline is not None and time.time() >= deadline:
+                return None
+            with self.lock:
+                self.host_ready.wait(
+                    self.config.shard_flush_interval if remaining is None
+                    else min(self.config.shard_flush_interval, remaining))
+
+    def done(self):
+        return self.finished
+
+    def close(self):
+        self.router.close()
+        super().close()
@@ -0,0 +1,147 @@
+import os
+import heapq
+import shutil
+import zlib
+
+from array import array
+
+SEGMENT_BYTES = 64 * 2**20 # a new segment file is started past this size
+
+
+def encode_block(entries):
+    """
+    Pack (score, url, depth) entries into one compressed block. Urls are
+    sorted and front-coded (each stores only how many bytes it shares with
+    the previous url, plus the rest), so urls of the same host mostly cost
+    their last path segment; zlib then squeezes the remainder.
+    """
+    entries = sorted(entries, key=lambda entry: entry[1])
+    scores, depths = array("d"), array("I")
+    prefixes, suffix_lengths = array("I"), array("I")
+    suffixes = list()
+    previous = b""
+    for score, url, depth in entries:
+        data = url.encode("utf-8")
+        shared = 0
+        limit = min(len(data), len(previous))
+        while shared < limit and data[shared] == previous[shared]:
+            shared += 1
+        scores.append(score)
+        depths.append(depth)
+        prefixes.append(shared)
+        suffix_lengths.append(len(data) - shared)
+        suffixes.append(data[shared:])
+        previous = data
+    payload = b"".join((
+        array("I", [len(entries)]).tobytes(), scores.tobytes(), depths.tobytes(),
+        prefixes.tobytes(), suffix_lengths.tobytes(), *suffixes))
+    return zlib.compress(payload, 1)
+
+
+def decode_block(block):
+    payload = zlib.decompress(block)
+    count = array("I")
+    count.frombytes(payload[:count.itemsize])
+    n = count[0]
+    offset = count.itemsize
+    columns = list()
+    for typecode in "dIII":
+        column = array(typecode)
+        size = n * column.itemsize
+        column.frombytes(payload[offset:offset + size])
+        columns.append(column)
+        offset += size
+    scores, depths, prefixes, suffix_lengths = columns
+    entries = list()
+    previous = b""
+    for i in range(n):
+        data = previous[:prefixes[i]] + payload[offset:offset + suffix_lengths[i]]
+        offset += suffix_lengths[i]
+        entries.append((scores[i], data.decode("utf-8"), depths[i]))
+        previous = data
+    return entries
+
+
+class SpillStore(object):
+    """
+    Overflow of the frontier's per-host queues on disk. Each spill() writes
+    one compressed block (see encode_block) to the end of the current
+    segment file, and only the block's location and best score stay in
+    memory. refill() reads a host's best block back. A segment file is
+    deleted once every block in it was refilled.
+
+    The store is scratch space: the pending table is what makes queued urls
+    survive a restart, so the directory is wiped when the store is opened.
+    Not thread safe; the frontier calls it under its lock.
+    """
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        self.blocks = dict() # host -> heap of (best score, segment, offset, length, count)
+        self.live_blocks = dict() # segment -> blocks not yet refilled
+        self.segment = -1
+        self.segment_file = None
+        self.segment_size = 0
+        self.urls = 0 # urls on disk
+        self.bytes = 0 # bytes of blocks on disk
+
+    def _path(self, segment):
+        return os.path.join(self.directory, f"{segment:06d}.seg")
+
+    def __contains__(self, host):
+        return host in self.blocks
+
+    def best_score(self, host):
+        return self.blocks[host][0][0]
+
+    def spill(self, host, entries):
+        ''' Write (score, url, depth) entries of host to disk. '''
+        if self.segment_file is None or self.segment_size >= self.segment_bytes:
+            self._next_segment()
+        block = encode_block(entries)
+        self.segment_file.write(block)
+        heapq.heappush(self.blocks.setdefault(host, list()), (
+            min(entry[0] for entry in entries), self.segment, self.segment_size,
+            len(block), len(entries)))
+        self.live_blocks[self.segment] += 1
+        self.segment_size += len(block)
+        self.urls += len(entries)
+        self.bytes += len(block)
+
+    def refill(self, host):
+        ''' Remove the best block of host from disk and return its entries. '''
+        blocks = self.blocks[host]
+        _, segment, offset, length, count = heapq.heappop(blocks)
+        if not blocks:
+            del self.blocks[host]
+        if segment == self.segment:
+            self.segment_file.flush()
+        with open(self._path(segment), "rb") as f:
+            f.seek(offset)
+            block = f.read(length)
+        self.urls -= count
+        self.bytes -= length
+        self.live_blocks[segment] -= 1
+        if not self.live_blocks[segment] and segment != self.segment:
+            del self.live_blocks[segment]
+            os.remove(self._path(segment))
+        return decode_block(block)
+
+    def _next_segment(self):
+        if self.segment_file is not None:
+            self.segment_file.close()
+            if not self.live_blocks[self.segment]:
+                del self.live_blocks[self.segment]
+                os.remove(self._path(self.segment))
+        self.segment += 1
+        self.segment_file = open(self._path(self.segment), "ab")
+        self.segment_size = 0
+        self.live_blocks[self.segment] = 0
+
+    def close(self):
+        if self.segment_file is not None:
+            self.segment_file.close()
+            self.segment_file = None
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -1,11 +1,15 @@
 from threading import Thread
+from collections import deque
 
 from inspect import getsource
-from utils.download import download
+from utils.download import download_async
 from utils import get_logger
+from utils.stats import STATS
 import scraper
-import time
 
+# A worker with nothing to do wakes up this often (seconds) while other
+# workers still hold pages that may add links.
+IDLE_WAIT = 5.0
 
 class Worker(Thread):
     def __init__(self, worker_id, config, frontier):
@@ -18,17 +22,42 @@ class Worker(Thread):
         super().__init__(daemon=True)
         
     def run(self):
+        in_flight = deque() # (url, future) in the order they were handed out
         while True:
-            tbd_url = self.frontier.get_tbd_url()
-            if not tbd_url:
-                self.logger.info("Frontier is empty. Stopping Crawler.")
-                break
-            resp = download(tbd_url, self.config, self.logger)
-            self.logger.info(
-                f"Downloaded {tbd_url}, status <{resp.status}>, "
-                f"using cache {self.config.cache_server}.")
-            scraped_urls = scraper.scraper(tbd_url, resp) # return list of URLs to add back to frontier
-            for scraped_url in scraped_urls:
-                self.frontier.add_url(scraped_url)
-            self.frontier.mark_url_complete(tbd_url)
-            time.sleep(self.config.time_delay)
+            # Keep up to INFLIGHT fetches going; only block on the frontier
+            # when there is nothing else to do.
+            while len(in_flight) < self.config.downloads_in_flight:
+                tbd_url = self.frontier.get_tbd_url(
+                    wait=not in_flight, timeout=IDLE_WAIT)
+                if not tbd_url:
+                    break
+                in_flight.append(
+                    (tbd_url, download_async(tbd_url, self.config, self.logger)))
+            if not in_flight:
+                # An empty frontier is not the end while other workers are
+                # still processing pages: wait for their links instead.
+                if self.frontier.done():
+                    self.logger.info("Frontier is empty. Stopping Crawler.")
+                    break
+                continue
+            tbd_url, future = in_flight.popleft()
+            try:
+                resp = future.result()
+                self.frontier.report_fetch(tbd_url, resp.status, resp.download_time)
+                self.logger.debug(
+                    f"Downloaded {tbd_url}, status <{resp.status}>, "
+                    f"using cache {self.config.cache_server}.")
+                scraped_urls = scraper.scraper(tbd_url, resp) # return list of URLs to add back to frontier
+                with STATS.timer("frontier_add"):
+                    self.frontier.add_urls(scraped_urls, tbd_url) # one frontier round-trip per page
+            except Exception:
+                # Other workers wait for every page handed out, and its host
+                # waits for the fetch to be reported, so a failed page is
+                # reported and completed rather than taking the thread down.
+                STATS.count("drop.worker_error")
+                self.logger.exception(f"Failed to process {tbd_url}.")
+                self.frontier.report_fetch(tbd_url, 0, None) # no-op if already reported
+            finally:
+                self.frontier.mark_url_complete(tbd_url)
+            STATS.count("pages")
+            STATS.maybe_dump()
@@ -1,17 +1,61 @@
+import os
+import sys
+import secrets
+import subprocess
+
 from configparser import ConfigParser
 from argparse import ArgumentParser
 
-from utils.server_registration import get_cache_server
 from utils.config import Config
+from utils.report import merge_reports, shard_report_dir
 from crawler import Crawler
+from crawler.frontier import Frontier
+from crawler.shard import AUTHKEY_ENV, ShardedFrontier, configure_shard
+import scraper
+
+
+def run_shards(config_file, restart, local_cache, shards):
+    ''' Run one crawler process per shard on this machine, then merge
+    their reports into the usual report files. Unless AUTHKEY is set, the
+    shards share a key made up for this run. '''
+    env = dict(os.environ)
+    env.setdefault(AUTHKEY_ENV, secrets.token_hex(32))
+    processes = list()
+    for shard in range(shards):
+        command = [
+            sys.executable, __file__, "--config_file", config_file,
+            "--shard", str(shard), "--shards", str(shards)]
+        if restart:
+            command.append("--restart")
+        if local_cache:
+            command += ["--local_cache", local_cache]
+        processes.append(subprocess.Popen(command, env=env))
+    for process in processes:
+        process.wait()
+    merge_reports(
+        scraper.REPORT_DIR,
+        [shard_report_dir(scraper.REPORT_DIR, shard) for shard in range(shards)])
 
 
-def main(config_file, restart):
+def main(config_file, restart, local_cache=None, shard=None, shards=1):
+    if shards > 1 and shard is None:
+        run_shards(config_file, restart, local_cache, shards)
+        return
     cparser = ConfigParser()
     cparser.read(config_file)
     config = Config(cparser)
-    config.cache_server = get_cache_server(config, restart)
-    crawler = Crawler(config, restart)
+    frontier_factory = Frontier
+    if shard is not None:
+        configure_shard(config, shard, shards)
+        frontier_factory = ShardedFrontier
+    if local_cache:
+        # Skip registration and use a stand-in such as benchmarks/cache_server.py
+        host, port = local_cache.rsplit(":", 1)
+        config.cache_server = (host, int(port))
+    else:
+        from utils.server_registration import get_cache_server # needs spacetime
+        config.cache_server = get_cache_server(config, restart)
+    crawler = Crawler(config, restart, frontier_factory=frontier_factory)
     crawler.start()
 
 
@@ -19,5 +63,23 @@ if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--restart", action="store_true", default=False)
     parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument(
+        "--local_cache", type=str, default=None,
+        help="HOST:PORT of a local cache server stand-in; skips registration")
+    parser.add_argument(
+        "--shards", type=int, default=1,
+        help="split the crawl by host across this many crawler processes")
+    parser.add_argument(
+        "--shard", type=int, default=None,
+        help="run only this shard (0 to SHARDS-1), e.g. one per machine; "
+             "merge with --merge_reports afterwards")
+    parser.add_argument(
+        "--merge_reports", action="store_true", default=False,
+        help="merge the reports of SHARDS shards into report/ and exit")
     args = parser.parse_args()
-    main(args.config_file, args.restart)
+    if args.merge_reports:
+        merge_reports(
+            scraper.REPORT_DIR,
+            [shard_report_dir(scraper.REPORT_DIR, shard) for shard in range(args.shards)])
+    else:
+        main(args.config_file, args.restart, args.local_cache, args.shard, args.shards)
@@ -1,12 +1,24 @@
 import re
-from urllib.parse import urlparse, urljoin, urldefrag, urlsplit, parse_qsl, urlencode, urlunsplit
+from urllib.parse import urljoin
 import configparser
 import logging
-from bs4 import BeautifulSoup
 import sys
 import os
+import time
 import hashlib
 import csv
+import multiprocessing
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from utils.report import Report, shard_report_dir
+from utils.parsers import get_extractor, header_charset
+from utils.url_filter import UrlFilter
+from utils.simhash import SimhashIndex, simhash
+from utils.digests import ContentDigestIndex, content_digest
+from utils.stats import STATS
+from utils.traps import TrapDetector, url_template
+from utils import get_logger
+from utils.canonical import canonicalize
 
 # #parse user agents from config.ini
 # def load_user_agents(config_path: str):
@@ -20,10 +32,17 @@ import csv
 
 MIN_WORDS = 100
 REPORT_DIR = "report"
-UNIQUE_PAGES = set()
-LONGEST_PAGE_URL = ""
-LONGEST_PAGE_WORDS = 0
-WORD_FREQ: dict[str, int] = {}
+REPORT = Report(REPORT_DIR) # unique pages, longest page, common words, subdomains
+PARSER_BACKEND = "stream" # HTML backend name, see configure()
+EXTRACT = get_extractor(PARSER_BACKEND)
+PARSE_POOL = None # ProcessPoolExecutor when PARSEPROCESSES > 0, see configure()
+NEAR_DUPLICATES = SimhashIndex() # SimHash fingerprints of accepted pages
+SIMHASH_FILE = None # where NEAR_DUPLICATES is saved, set by configure()
+EXACT_DUPLICATES = ContentDigestIndex() # digests of the visible text of processed pages
+DIGEST_FILE = None # where EXACT_DUPLICATES is saved, set by configure()
+TRAPS = TrapDetector() # enqueue and low-info counts per url template
+TRAP_FILE = None # where TRAPS is saved, set by configure()
+REPORT_FILE = None # where REPORT is checkpointed, set by configure()
 STOPWORDS = {
     "a","about","above","after","again","against","all","am","an","and","any","are",
     "aren't","as","at","be","because","been","before","being","below","between","both",
@@ -42,22 +61,95 @@ STOPWORDS = {
     "why","why's","with","won't","would","wouldn't","you","you'd","you'll","you're","you've",
     "your","yours","yourself","yourselves"
 }
-SUBDOMAIN_COUNTS: dict[str, int] = {}
+TOKEN_PATTERN = re.compile(r"[^\W_]+") # runs of characters for which str.isalnum() is true
+PageStats = namedtuple("PageStats", ["word_count", "unique_ratio", "term_counts"])
+# Compact result of parse_page, sent back from a parse process.
+ParsedPage = namedtuple(
+    "ParsedPage", ["digest", "stats", "fingerprint", "links", "parse_seconds", "tokenize_seconds"])
 
-# configure logging
+# configure logging: handlers are attached by configure(), see utils.get_logger
 logger = logging.getLogger(__name__)
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setLevel(logging.INFO)
-formatter = logging.Formatter(
-    "%(asctime)s | %(levelname)s | %(message)s"
-)
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
+
+
+def configure(config, restart=False):
+    """
+    Apply the scraper options from config.ini and load the state saved next
+    to the frontier (or discard it on restart). Called once by the Crawler
+    before any Worker starts.
+    """
+    global REPORT, PARSER_BACKEND, EXTRACT, PARSE_POOL
+    global NEAR_DUPLICATES, SIMHASH_FILE, EXACT_DUPLICATES, DIGEST_FILE, TRAPS, TRAP_FILE
+    global REPORT_FILE
+    get_logger(__name__, "Scraper") # queue-backed handlers, once
+    if config.shard_id is not None: # merged into REPORT_DIR by launch.py
+        REPORT = Report(shard_report_dir(REPORT_DIR, config.shard_id))
+    PARSER_BACKEND = config.parser_backend
+    EXTRACT = get_extractor(PARSER_BACKEND)
+    if config.parse_processes > 0:
+        # spawn, not fork: worker and download threads are already running.
+        PARSE_POOL = ProcessPoolExecutor(
+            max_workers=config.parse_processes,
+            mp_context=multiprocessing.get_context("spawn"))
+    SIMHASH_FILE = f"{config.save_file}.simhash"
+    DIGEST_FILE = f"{config.save_file}.digests"
+    TRAP_FILE = f"{config.save_file}.traps"
+    REPORT_FILE = f"{config.save_file}.report"
+    if restart:
+        for path in (SIMHASH_FILE, DIGEST_FILE, TRAP_FILE,
+                     REPORT_FILE, f"{REPORT_FILE}.delta", f"{REPORT_FILE}.delta.old"):
+            if os.path.exists(path):
+                os.remove(path)
+    NEAR_DUPLICATES = SimhashIndex.load(SIMHASH_FILE, config.near_dup_distance)
+    EXACT_DUPLICATES = ContentDigestIndex.load(DIGEST_FILE)
+    TRAPS = TrapDetector.load(
+        TRAP_FILE, config.trap_budget, config.trap_min_pages, config.trap_low_info_ratio)
+    REPORT.restore(REPORT_FILE)
+
+
+def save_state():
+    """
+    Persist the scraper state that must survive a resume. The frontier calls
+    this at each checkpoint so it stays in step with the save file.
+    """
+    if SIMHASH_FILE:
+        NEAR_DUPLICATES.save(SIMHASH_FILE)
+    if DIGEST_FILE:
+        EXACT_DUPLICATES.save(DIGEST_FILE)
+    if TRAP_FILE:
+        TRAPS.save(TRAP_FILE)
+    REPORT.checkpoint() # written in the background
+
+
+def commit_state():
+    """
+    Make the report changes since the last call durable. The frontier calls
+    this before each journal commit, so a page marked complete on disk is
+    never missing from the report after a resume.
+    """
+    REPORT.commit()
+
+
+def close():
+    """
+    Write the final reports and stop the parse processes. Called by the
+    Crawler once every Worker is done.
+    """
+    global PARSE_POOL
+    REPORT.close()
+    if PARSE_POOL is not None:
+        PARSE_POOL.shutdown()
+        PARSE_POOL = None
 
 
 def scraper(url, resp):
     links = extract_next_links(url, resp)
-    return [link for link in links if is_valid(link)]
+    with STATS.timer("filter"):
+        valid_links, rejected = URL_FILTER.filter_links(links) # whole page in one call
+    if rejected:
+        for reason, hits in rejected.items():
+            STATS.count(f"filtered.{reason}", hits)
+        logger.debug(f"FILTERED {sum(rejected.values())} links from {url}: {dict(rejected)}")
+    return valid_links
 
 
 def extract_next_links(url, resp):
@@ -72,224 +164,278 @@ def extract_next_links(url, resp):
     #         resp.raw_response.url: the url, again
     #         resp.raw_response.content: the content of the page!
     # Return a list with the hyperlinks (as strings) scrapped from resp.raw_response.content
-    global LONGEST_PAGE_WORDS, LONGEST_PAGE_URL
-    logger.info(f"START crawling URL: {url}")
+    logger.debug(f"START crawling URL: {url}")
+    content, links = check_response(url, resp)
+    if content is None:
+        return links
+
+    # grab links in resp.raw_response.content
+    try:
+        logger.debug(f"Begin analyzing content url={url}")
+        encoding = declared_charset(resp)
+        if PARSE_POOL is not None:
+            # Parse, tokenize and canonicalize in another process, outside the GIL.
+            page = PARSE_POOL.submit(
+                parse_page, resp.url, content, PARSER_BACKEND, encoding).result()
+            return merge_parsed_page(url, resp.url, page)
+
+        with STATS.timer("parse"):
+            text, hrefs = EXTRACT(content, encoding) # visible text and <a href> values in one parse
+
+        # Exact duplicates (mirrors, http vs https, query variants) skip
+        # tokenization, word counts and link extraction entirely.
+        if is_exact_duplicate(content_digest(text), url):
+            return []
+
+        with STATS.timer("tokenize"):
+            stats = analyze_text(text) # the only tokenizer pass over the page
+        if low_info_wrapper(stats, url):
+            return []
+
+        # Near-duplicate pages (wiki revisions, paginated listings) are dropped
+        # before their links are extracted.
+        if is_near_duplicate(simhash(stats.term_counts), url):
+            return []
+
+        # #save_page_content(resp.url, text) # save the text content
+        record_template(url, low_info=False)
+        record_page(resp.url, stats)
+        return extract_links(resp.url, hrefs)
 
+    except Exception as e:
+        STATS.count("drop.parse_error")
+        logger.warning(f"Error parsing {url}: {e}")
+        return []
+
+
+def check_response(url, resp):
+    """
+    Status and header checks that run before any parsing.
+    Returns (content, []) when the page should be parsed, otherwise
+    (None, links to crawl instead), e.g. the target of a redirect.
+    Only the status and size checks are free; reading resp.headers decodes
+    the whole response (see utils/response.py), so header checks come after
+    the checks that can drop a page without it.
+    """
     # Handle server status codes and redirects
     CACHE_SERVER_ERRORS = {600, 601, 602, 603, 604, 605, 606, 607, 608}
 
     # If the downloader gave no response object
     if resp is None:
+        STATS.count("drop.no_response")
         logger.error(f"DROP no response, url: {url}")
-        return []
+        return None, []
     
     # If it's a cache server error, log and drop completely since these are likely transient and not useful for extraction
     if resp.status in CACHE_SERVER_ERRORS:
-        logger.info(f"DROPPED {url} due to cache server error={resp.status}")
-        return []
+        STATS.count("drop.cache_error")
+        logger.debug(f"DROPPED {url} due to cache server error={resp.status}")
+        return None, []
     
     # If it's a redirect (301/302), log and return the redirect URL for crawling since these can lead to valid pages. The crawler will handle the redirect URL as a new crawl.
     if resp.status in {301, 302}:
         redirect_url = resp.headers.get("Location")
         if redirect_url:
-            logger.info(f"REDIRECT {url} TO {redirect_url}")
-            return [redirect_url] # return the redirect URL for crawler to handle as a new crawl
+            redirect_url = canonicalize(urljoin(url, redirect_url)).url # Location may be relative
+            STATS.count("redirect")
+            logger.debug(f"REDIRECT {url} TO {redirect_url}")
+            return None, [redirect_url] # return the redirect URL for crawler to handle as a new crawl
         else:
-            logger.warning(f"DROPPED {url}: redirect without location header")
-            return []      
+            STATS.count("drop.redirect_without_location")
+            logger.debug(f"DROPPED {url}: redirect without location header")
+            return None, []      
     
     # If the server did not return 200 (OK), skip parsing links from it since it may be unreliable for extraction
     if resp.status != 200: #Comment (Quang): This one can miss the redirect links with code 301/302 which may lead to other valid pages. The code in other files already handle the redirect links correctly for us.
-        logger.warning(f"DROP status={resp.status} error={resp.error} url={url}")
-        return []
+        STATS.count("drop.http_status")
+        logger.debug(f"DROP status={resp.status} error={resp.error} url={url}")
+        return None, []
      
     
+    # Payloads over MAXBYTES are refused before they are decoded.
+    if resp.too_large:
+        add_unique_page(resp.url)
+        STATS.count("drop.large_file")
+        logger.debug(f"DROP large_file payload={resp.payload_size} bytes url={url}")
+        return None, []
+
     # If raw response is None, cant access content attribute, so check this before
     if resp.raw_response is None:
+        STATS.count("drop.no_raw_response")
         logger.error(f"DROP no raw_response, url: {url}")
-        return []
+        return None, []
     
     # If the response has no content, no links can be extracted 
     content = resp.raw_response.content
     if not content:
+        STATS.count("drop.no_content")
         logger.error(f"DROP no content, url: {url}")
-        return []
+        return None, []
     
     add_unique_page(resp.url)   
 
     if is_large_file(resp):
-        logger.info(f"DROP large_file url={url}")
-        return []
-    
-    # grab links in resp.raw_response.content
-    try:
-        logger.info(f"Begin analyzing content url={url}")
-        soup = BeautifulSoup(content, 'html.parser')
+        STATS.count("drop.large_file")
+        logger.debug(f"DROP large_file url={url}")
+        return None, []
 
-        # Sources : https://stackoverflow.com/questions/30565404/remove-all-style-scripts-and-html-tags-from-an-html-page
-        for tag in soup(["script", "style"]):
-            tag.decompose()
-        text = soup.get_text(separator=" ").strip()
+    if no_data_wrapper(resp):
+        return None, []
+    return content, []
 
-        if no_data_wrapper(resp, text):
-            return []
-        #
-        if low_info_wrapper(text, url):
-            return []
 
-        # #save_page_content(resp.url, text) # save the text content
-        update_word_frequencies(text)    
-        page_url = urldefrag(resp.url)[0] 
-        update_subdomain_counts(resp.url, SUBDOMAIN_COUNTS)
-
-        wc = count_words(text)
-        if wc > LONGEST_PAGE_WORDS:
-            LONGEST_PAGE_WORDS = wc
-            LONGEST_PAGE_URL = page_url
-
-        # extract links
-        extracted_links = set()
-        for tag in soup.find_all('a', href=True):
-            link = urljoin(resp.url, tag['href']) 
-            clean_link = urldefrag(link)[0]
-            clean_link = similar_no_info(clean_link) 
-
-            extracted_links.add(clean_link)
-
-        write_unique_pages_report()
-        write_longest_page_report()
-        write_top_50_words("common_words.txt")
-        write_subdomains_report(SUBDOMAIN_COUNTS, "subdomains.txt")
-            
-        return list(extracted_links)
+def parse_page(page_url, content, parser_backend, encoding=None) -> ParsedPage:
+    """
+    Everything CPU-heavy about a page, as a pure function so it can run in a
+    parse process: parse, tokenize, fingerprint and canonicalize the links.
+    encoding is the charset of the page's Content-Type header, if any.
+    """
+    start = time.perf_counter()
+    text, hrefs = get_extractor(parser_backend)(content, encoding)
+    parsed = time.perf_counter()
+    stats = analyze_text(text)
+    tokenized = time.perf_counter()
+    return ParsedPage(
+        content_digest(text), stats, simhash(stats.term_counts),
+        extract_links(page_url, hrefs), parsed - start, tokenized - parsed)
 
-    except Exception as e:
-        logger.warning(f"Error parsing {url}: {e}")
+
+def merge_parsed_page(url, page_url, page: ParsedPage) -> list:
+    """
+    Apply a ParsedPage to the crawl state (duplicate indexes, reports) and
+    return its links, mirroring the in-thread path of extract_next_links.
+    """
+    STATS.observe("parse", page.parse_seconds) # timed in the parse process
+    STATS.observe("tokenize", page.tokenize_seconds)
+    if is_exact_duplicate(page.digest, url):
+        return []
+    if low_info_wrapper(page.stats, url):
+        return []
+    if is_near_duplicate(page.fingerprint, url):
         return []
+    record_template(url, low_info=False)
+    record_page(page_url, page.stats)
+    return page.links
+
+
+def is_exact_duplicate(digest, url) -> bool:
+    REPORT.count_duplicate("checked", url)
+    if EXACT_DUPLICATES.check_and_add(digest):
+        REPORT.count_duplicate("exact", url)
+        STATS.count("drop.exact_duplicate")
+        record_template(url, low_info=True)
+        logger.debug(f"DROPPED exact_duplicate url={url}")
+        return True
+    return False
+
+
+def is_near_duplicate(fingerprint, url) -> bool:
+    if NEAR_DUPLICATES.check_and_add(fingerprint):
+        REPORT.count_duplicate("near", url)
+        STATS.count("drop.near_duplicate")
+        record_template(url, low_info=True)
+        logger.debug(f"DROPPED near_duplicate url={url}")
+        return True
+    return False
+
+
+def record_page(fetched_url, stats: PageStats) -> None:
+    page = canonicalize(fetched_url)
+    with STATS.timer("report"):
+        REPORT.add_page(page.url, page.host, stats.word_count, stats.term_counts) # summaries are rewritten periodically
+
+
+def extract_links(page_url, hrefs) -> list:
+    # Same page in different forms (fragments, relative vs absolute, query
+    # order, trailing slash) ends up as one link; see utils/canonical.py.
+    extracted_links = set()
+    for href in hrefs:
+        link = urljoin(page_url, href)
+        extracted_links.add(canonicalize(link).url)
+    return list(extracted_links)
 
 
 def is_valid(url):
     # Decide whether to crawl this url or not. 
     # If you decide to crawl it, return True; otherwise return False.
-    # There are already some conditions that return False.
+    # The rules live in utils/url_filter.py as precompiled patterns, and
+    # verdicts are cached per url.
+    reason = URL_FILTER.check(url)
+    if reason in TRAP_MESSAGES:
+        logger.debug(f"DROPPED {TRAP_MESSAGES[reason]} URL: {url}")
+    return reason is None
 
-    try:
-        parsed = urlparse(url)
-        if parsed.scheme not in set(["http", "https"]):
-            return False
 
-        path = parsed.path.lower()
-        if any(key in path for key in ["/auth/", "/signin", "/login", "/logout", "/oauth"]): # filter authentication related urls
-            return False
-        
-        # host must be in allowed domain set
-        host = parsed.hostname 
-        if host is None:
-            host = ""
-        else:
-            host = host.lower() # hostnames are case-insensitive
-        if not (
-            host.endswith(".ics.uci.edu")
-            or host.endswith(".cs.uci.edu")
-            or host.endswith(".informatics.uci.edu")
-            or host.endswith(".stat.uci.edu")
-        ):
-            return False
-        
-        if re.match(
-            r".*\.(css|js|bmp|gif|jpe?g|ico"
-            + r"|png|tiff?|mid|mp2|mp3|mp4"
-            + r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
-            + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
-            + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
-            + r"|epub|dll|cnf|tgz|sha1"
-            + r"|thmx|mso|arff|rtf|jar|csv"
-            + r"|rm|smil|wmv|swf|wma|zip|rar|gz)$", parsed.path.lower()):
-            return False
-    
-        # --- TRAP DETECTIONS ---
-        #Reference: https://developers.google.com/search/docs/crawling-indexing/url-structure, https://support.archive-it.org/hc/en-us/articles/208332943-How-to-identify-and-avoid-crawler-traps, https://en.wikipedia.org/wiki/Spider_trap
-        #1. Avoid infinite calendar trap: for example, URLs with /calendar/2024/01/01, /calendar/2024/01/01, etc.
-        calendar_pattern = re.compile(r"/calendar/\d{4}/\d{1,2}/\d{1,2}")
-        if calendar_pattern.search(parsed.path.lower()):
-            logger.info(f"DROPPED infinite calendar URL: {url}")
-            return False
-        
-        #2. Avoid session IDs in query session=, sid=, jseesionid=
-        if parsed.query:
-            query_params = dict(parse_qsl(parsed.query))
-            session_keys = {"session", "sid", "jsessionid"}
-            if any(key.lower() in session_keys for key in query_params):
-                logger.info(f"DROPPED session ID URL: {url}")
-                return False
-            
-        #3. Avoid spider traps / manual patterns
-        #Example: very long numeric path segments (common traps)
-        segments = [seg for seg in parsed.path.split("/") if seg]
-        if any(len(seg) > 50 for seg in segments):
-            logger.info(f"DROPPED suspicious long segment URL: {url}")
-            return False
-        
-        return True
+def admit_url(url) -> bool:
+    """
+    Called by the frontier for each new url. Counts it against its url
+    template's budget (utils/traps.py) and refuses it once the template
+    looks like a trap.
+    """
+    reason = TRAPS.admit(url)
+    if reason:
+        STATS.count(f"drop.{reason}")
+        logger.debug(f"DROPPED {reason} url={url}")
+        return False
+    return True
 
-    except TypeError:
-        print ("TypeError for ", parsed)
-        raise
 
+def is_trap(url) -> bool:
+    ''' True if url's template turned out to be low-info after url was
+    queued. (Queued urls were admitted within the template's budget.) '''
+    return TRAPS.check(url) == "trap_low_info"
+
+
+def template_low_info(url) -> float:
+    ''' Low-info share of url's template so far, for the frontier's priority. '''
+    return TRAPS.low_info_share(url)
+
+
+def host_yield(host) -> int:
+    ''' How many pages of host made it into the report. '''
+    return REPORT.subdomain_counts.get(host, 0)
 
-def tokenize_text(text: str):
-    # allow non-English characters for this assignment
-    current = []
-    for ch in text:
-        if ch.isalnum():        
-            current.append(ch.lower())
-        else:
-            if current:
-                yield "".join(current)
-                current.clear()
 
-    if current:
-        yield "".join(current)
-        current.clear()
+def record_template(url, low_info: bool) -> None:
+    reason = TRAPS.record_page(url, low_info)
+    if reason:
+        logger.warning(f"TRAP {reason}: closing url template {url_template(url)}")
 
 
-# --- Handling similar pages with no information --- 
-def similar_no_info(url: str) -> str:
+def tokenize_text(text: str) -> list[str]:
+    # allow non-English characters for this assignment
+    return [token.lower() for token in TOKEN_PATTERN.findall(text)]
+
+
+def analyze_text(text: str) -> PageStats:
     """
-    Source : Google AI Overview was used to understand how to utilize urlsplit(),
-    parse_qsl
-
-    Handle different URL string that points to the same page.
-    This includes:
-    1. Different fragments -> resolved using urldefrag()
-    2. Relative cs Absolute path -> resolved using join()
-    3. Query parameter order
+    Tokenize the page once and derive everything the scraper needs from it:
+    the word count, the unique-token ratio over the first 500 tokens, and the
+    filtered term counts used for the common words report.
     """
-    url_components = urlsplit(url)
-    scheme = url_components.scheme
-    network_location = url_components.netloc.lower()
-    path = url_components.path if url_components.path else "/" # if path is empty, path is a /
-    query = url_components.query
-
-    # 3. Query parameter order
-    if query:
-        logger.debug(f"raw query: {query}")
-        params = parse_qsl(query, keep_blank_values=True) # returns a list of key, value pairs
-        params.sort() # sort by key, then value -- ensures unique ordering for same query in different order
-        query = urlencode(params)
-        logger.debug(f"cleaned query: {query}")
-    
-    return urlunsplit((scheme, network_location, path, query, ""))
+    tokens = tokenize_text(text)
+    head = tokens[:500] # Check the first 500 tokens
+    unique_ratio = len(set(head)) / len(head) if head else 0.0
+
+    term_counts = Counter(tokens)
+    for token in list(term_counts):
+        if len(token) <= 1 or token.isdigit() or token in STOPWORDS: # remove one letter and numbers
+            del term_counts[token]
+    return PageStats(len(tokens), unique_ratio, term_counts)
 
 
 # --- Handling pages with thin content/junk --- 
-def low_info_wrapper(text: str, url: str) -> bool:
-    if not has_min_words(text):
-        logger.info(f"DROPPED reason=min_words, url={url}")
+def low_info_wrapper(stats: PageStats, url: str) -> bool:
+    if not has_min_words(stats):
+        STATS.count("drop.low_info.min_words")
+        record_template(url, low_info=True)
+        logger.debug(f"DROPPED reason=min_words, url={url}")
         return True
 
-    if has_repeated_tokens(text):
-        logger.info(f"DROPPED reason=few_unique_tokens, url={url}")
+    if has_repeated_tokens(stats):
+        STATS.count("drop.low_info.few_unique_tokens")
+        record_template(url, low_info=True)
+        logger.debug(f"DROPPED reason=few_unique_tokens, url={url}")
         return True
 
     # if has_repeated_sentences(text, min_len=30, repeat_threshold=10):
@@ -299,32 +445,15 @@ def low_info_wrapper(text: str, url: str) -> bool:
     return False
 
 
-def has_min_words(text: str) -> bool:
-    count = 0
-    for token in tokenize_text(text):
-        count += 1
-        if count >= MIN_WORDS:
-            return True
-    return False
+def has_min_words(stats: PageStats) -> bool:
+    return stats.word_count >= MIN_WORDS
 
 
-def has_repeated_tokens(text: str) -> bool:
+def has_repeated_tokens(stats: PageStats) -> bool:
     """
     Handle pages that lacks diveristy in words, which may be junk
     """
-    total = 0
-    unique_tokens = set()
-
-    for tok in tokenize_text(text):
-        total += 1
-        unique_tokens.add(tok)
-        if total >= 500:  # Check the first 500 tokens
-            break
-
-    if total == 0:
-        return True
-    unique_ratio = len(unique_tokens) / total
-    return unique_ratio < 0.05
+    return stats.unique_ratio < 0.05
 
 
 # def has_repeated_sentences(text: str) -> bool:
@@ -354,13 +483,14 @@ def has_repeated_tokens(text: str) -> bool:
 
 
 # --- Handling 200, but no data ---
-def no_data_wrapper(response, text: str) -> bool:
+def no_data_wrapper(response) -> bool:
     '''
     Wrapper for 200, but no data.
     '''
 
     if not is_html_content_type(response):
-        logger.info(f"DROPPED 200_no_data reason=non_html url={response.url}")
+        STATS.count("drop.non_html")
+        logger.debug(f"DROPPED 200_no_data reason=non_html url={response.url}")
         return True
 
     return False
@@ -372,7 +502,7 @@ def is_html_content_type(response) -> bool:
     i.e. If it is not text data, but instead is pdf or image, then don't crawl
     """
     try:
-        headers = response.raw_response.headers 
+        headers = response.headers
         content_type = (headers.get("Content-Type") or "").lower()  
     except (AttributeError, TypeError):
         return True
@@ -383,10 +513,21 @@ def is_html_content_type(response) -> bool:
     return True
 
 
+def declared_charset(response):
+    """
+    Charset of the Content-Type header, or None. The page itself may still
+    declare one in a <meta> tag, which utils/parsers.py looks for.
+    """
+    try:
+        return header_charset(response.headers.get("Content-Type"))
+    except (AttributeError, TypeError):
+        return None
+
+
 # --- Handling Large files, Low info --- 
 def is_large_file(resp) -> bool:
     try:
-        headers = resp.raw_response.headers
+        headers = resp.headers
         content_length = headers.get("Content-Length")
         if content_length and content_length.isdigit():
             size_bytes = int(content_length)
@@ -399,9 +540,6 @@ def is_large_file(resp) -> bool:
 
 
 
-# TODO Shizuka -- EC Simhas
-
-
 # --- Report ---
 ALLOWED = (
     ".ics.uci.edu",
@@ -409,76 +547,20 @@ ALLOWED = (
     ".informatics.uci.edu",
     ".stat.uci.edu",
 )
+URL_FILTER = UrlFilter(ALLOWED) # compiled is_valid rules
+TRAP_MESSAGES = {
+    "calendar_trap": "infinite calendar",
+    "session_id": "session ID",
+    "long_segment": "suspicious long segment",
+}
 
 
 def is_allowed_host(host: str) -> bool:
     host = (host or "").lower()
-    return any(host.endswith(suffix) for suffix in ALLOWED)
+    return URL_FILTER.allowed.matches(host)
 
 
 def add_unique_page(fetched_url: str) -> None:
-    clean_url= urldefrag(fetched_url)[0]
-    host = (urlparse(clean_url).hostname or "").lower()
-    if is_allowed_host(host):
-        UNIQUE_PAGES.add(clean_url)
-
-
-def write_unique_pages_report() -> None:
-    os.makedirs(REPORT_DIR, exist_ok=True)
-    out_path = os.path.join(REPORT_DIR, "unique_pages.txt")
-    with open(out_path, "w") as f:
-        f.write(f"Unique pages: {len(UNIQUE_PAGES)}\n")
-        f.write("\n")
-        for u in sorted(UNIQUE_PAGES):
-            f.write(u + "\n")
-
-
-def count_words(text: str) -> int:
-    num_words = 0
-    for _ in tokenize_text(text):
-        num_words += 1
-    return num_words
-
-
-def write_longest_page_report() -> None:
-    os.makedirs(REPORT_DIR, exist_ok=True)
-    out_path = os.path.join(REPORT_DIR, "longest_page.txt")
-    with open(out_path, "w") as f:
-        f.write(f"Longest page (num of words): {LONGEST_PAGE_WORDS}\n")
-        f.write(f"URL: {LONGEST_PAGE_URL}\n")
-
-
-def update_word_frequencies(text: str) -> None:
-    for token in tokenize_text(text):
-        if token.isalnum() and len(token) <= 1:     # remove one letter, still include digit     
-            continue
-        if token.isdigit():
-            continue
-        if token in STOPWORDS:
-            continue
-        WORD_FREQ[token] = WORD_FREQ.get(token, 0) + 1
-
-
-def write_top_50_words(out_path: str) -> None:
-    os.makedirs(REPORT_DIR, exist_ok=True)
-    out_path = os.path.join(REPORT_DIR, "common_words.txt")
-    items = sorted(WORD_FREQ.items(), key=lambda kv: (-kv[1], kv[0]))[:50]
-    with open(out_path, "w", encoding="utf-8") as f:
-        for word, count in items:
-            f.write(f"{word}, {count}\n")
-
-
-def update_subdomain_counts(url: str, subdomain_counts: dict[str, int]) -> None:
-    clean_url = urldefrag(url)[0]
-    host = (urlparse(clean_url).hostname or "").lower()
-    if not host:
-        return
-    subdomain_counts[host] = subdomain_counts.get(host, 0) + 1
-
-
-def write_subdomains_report(subdomain_counts: dict[str, int], out_path: str) -> None:
-    os.makedirs(REPORT_DIR, exist_ok=True)
-    out_path = os.path.join(REPORT_DIR, "subdomains.txt")
-    with open(out_path, "w", encoding="utf-8") as f:
-        for host in sorted(subdomain_counts.keys()):
-            f.write(f"{host}, {subdomain_counts[host]}\n")
\ No newline at end of file
+    page = canonicalize(fetched_url)
+    if is_allowed_host(page.host):
+        REPORT.add_unique_page(page.url)
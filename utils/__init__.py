@@ -1,35 +1,107 @@
 import os
+import atexit
 import logging
-from hashlib import sha256
-from urllib.parse import urlparse
+from itertools import count
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from threading import Lock
+
+from utils.canonical import canonicalize
+
+# Records go through a queue per log file and are written by a background
+# QueueListener, so threads never wait on file or console I/O. Handlers are
+# created once per file and once per logger, however often get_logger runs.
+LOG_LEVEL = logging.INFO
+LOG_SAMPLE = 0 # when > 0, one in LOG_SAMPLE DEBUG records (per-URL lines) is kept
+_log_lock = Lock()
+_queue_handlers = dict() # log file name -> QueueHandler feeding its listener
+_listeners = list()
+_loggers = dict() # logger name -> logger set up by get_logger
+_console = None
+
+
+class SampleFilter(logging.Filter):
+    ''' Keeps every record above DEBUG and one in LOG_SAMPLE DEBUG records. '''
+    def __init__(self):
+        super().__init__()
+        self.counter = count()
+
+    def filter(self, record):
+        if record.levelno >= LOG_LEVEL:
+            return True
+        return (record.levelno == logging.DEBUG and LOG_SAMPLE > 0
+                and next(self.counter) % LOG_SAMPLE == 0)
+
+
+def _logger_level():
+    return logging.DEBUG if LOG_SAMPLE > 0 else LOG_LEVEL
+
+
+def configure_logging(config):
+    ''' Apply LOGLEVEL and LOGSAMPLE to every logger, present and future. '''
+    global LOG_LEVEL, LOG_SAMPLE
+    with _log_lock:
+        LOG_LEVEL = logging.getLevelName(config.log_level.upper())
+        LOG_SAMPLE = config.log_sample
+        for logger in _loggers.values():
+            logger.setLevel(_logger_level())
+
+
+def _queue_handler(filename):
+    ''' Caller must hold _log_lock. '''
+    global _console
+    handler = _queue_handlers.get(filename)
+    if handler is None:
+        os.makedirs("Logs", exist_ok=True)
+        formatter = logging.Formatter(
+           "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        fh = logging.FileHandler(f"Logs/{filename}.log")
+        fh.setLevel(logging.DEBUG)
+        fh.setFormatter(formatter)
+        if _console is None: # one console handler shared by every listener
+            _console = logging.StreamHandler()
+            _console.setLevel(logging.INFO)
+            _console.setFormatter(formatter)
+        queue = SimpleQueue()
+        listener = QueueListener(queue, fh, _console, respect_handler_level=True)
+        listener.start()
+        _listeners.append(listener)
+        handler = _queue_handlers[filename] = QueueHandler(queue)
+        handler.addFilter(SampleFilter())
+    return handler
+
 
 def get_logger(name, filename=None):
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
-    if not os.path.exists("Logs"):
-        os.makedirs("Logs")
-    fh = logging.FileHandler(f"Logs/{filename if filename else name}.log")
-    fh.setLevel(logging.DEBUG)
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.INFO)
-    formatter = logging.Formatter(
-       "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    fh.setFormatter(formatter)
-    ch.setFormatter(formatter)
-    # add the handlers to the logger
-    logger.addHandler(fh)
-    logger.addHandler(ch)
-    return logger
+    with _log_lock:
+        logger = _loggers.get(name)
+        if logger is None:
+            logger = _loggers[name] = logging.getLogger(name)
+            logger.setLevel(_logger_level())
+            logger.addHandler(_queue_handler(filename if filename else name))
+            logger.propagate = False
+        return logger
+
+
+@atexit.register
+def stop_logging():
+    ''' Write out everything still queued. '''
+    with _log_lock:
+        while _listeners:
+            _listeners.pop().stop()
 
 
 def get_urlhash(url):
-    parsed = urlparse(url)
-    # everything other than scheme.
-    return sha256(
-        f"{parsed.netloc}/{parsed.path}/{parsed.params}/"
-        f"{parsed.query}/{parsed.fragment}".encode("utf-8")).hexdigest()
+    # everything other than scheme, of the canonical url (see utils/canonical.py).
+    return canonicalize(url).urlhash
 
 def normalize(url):
-    if url.endswith("/"):
-        return url.rstrip("/")
-    return url
+    return canonicalize(url).url
+
+def atomic_write(path, data):
+    ''' Replace the file at path with data so readers never see a partial file. '''
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
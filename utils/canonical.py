@@ -0,0 +1,55 @@
+from collections import namedtuple
+from functools import lru_cache
+from hashlib import sha256
+from urllib.parse import urlsplit, urlparse, parse_qsl, urlencode, urlunsplit
+
+# A page's links are canonicalized, filtered and queued in a row, so only
+# recent urls are worth keeping; each entry costs about 0.5 KiB.
+CACHE_SIZE = 4096
+
+
+class CanonicalUrl(namedtuple("CanonicalUrl", ["url", "host", "hash"])):
+    """
+    url: canonical form; host: lowercased hostname; hash: 64-bit int of the
+    url's key. The hex key itself (urlhash) is derived when asked for, so
+    the memoized entries stay small.
+    """
+    __slots__ = ()
+
+    @property
+    def urlhash(self):
+        ''' Key of the save file and seen-set (see key_of). '''
+        return key_of(self.url)
+
+
+def key_of(url):
+    ''' Save file key of an already canonical url: sha256 of everything but
+    the scheme, computed as it always was, so existing save files keep
+    their keys. '''
+    parsed = urlparse(url)
+    return sha256(
+        f"{parsed.netloc}/{parsed.path}/{parsed.params}/"
+        f"{parsed.query}/{parsed.fragment}".encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def canonicalize(url):
+    """
+    The one canonical form of a url, used by the scraper, the frontier and
+    the report, so the same page is never stored or counted twice:
+    the fragment is dropped, the host lowercased, query parameters sorted,
+    an empty path becomes "/" and trailing slashes are stripped (so
+    https://h/a/ and https://h/a are the same page). The url is split once;
+    results are memoized, as every link is looked up several times on its
+    way from a page to the frontier.
+    """
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    query = parts.query
+    if query:
+        # Same parameters in a different order are the same page.
+        query = urlencode(sorted(parse_qsl(query, keep_blank_values=True)))
+    canonical = urlunsplit((parts.scheme, parts.netloc.lower(), path, query, ""))
+    if canonical.endswith("/"):
+        canonical = canonical.rstrip("/")
+    return CanonicalUrl(canonical, parts.hostname or "", int(key_of(canonical)[:16], 16))
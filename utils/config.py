@@ -9,11 +9,51 @@ class Config(object):
         assert re.match(r"^[a-zA-Z0-9_ ,]+$", self.user_agent), "User agent should not have any special characters outside '_', ',' and 'space'"
         self.threads_count = int(config["LOCAL PROPERTIES"]["THREADCOUNT"])
         self.save_file = config["LOCAL PROPERTIES"]["SAVE"]
+        self.commit_batch = int(config["LOCAL PROPERTIES"].get("COMMITBATCH", "200"))
+        self.commit_window = float(config["LOCAL PROPERTIES"].get("COMMITWINDOW", "1.0"))
+        self.expected_urls = int(config["LOCAL PROPERTIES"].get("EXPECTEDURLS", "1000000"))
+        self.hot_urls = int(config["LOCAL PROPERTIES"].get("HOTURLS", "200000"))
+        self.parse_processes = int(config["LOCAL PROPERTIES"].get("PARSEPROCESSES", "0"))
+        self.stats_file = config["LOCAL PROPERTIES"].get("STATSFILE", "Logs/stats.jsonl").strip()
+        self.stats_interval = float(config["LOCAL PROPERTIES"].get("STATSINTERVAL", "30"))
+        self.log_level = config["LOCAL PROPERTIES"].get("LOGLEVEL", "INFO").strip()
+        self.log_sample = int(config["LOCAL PROPERTIES"].get("LOGSAMPLE", "0"))
 
         self.host = config["CONNECTION"]["HOST"]
         self.port = int(config["CONNECTION"]["PORT"])
 
         self.seed_urls = config["CRAWLER"]["SEEDURL"].split(",")
         self.time_delay = float(config["CRAWLER"]["POLITENESS"])
+        self.max_time_delay = float(config["CRAWLER"].get("MAXPOLITENESS", "30"))
+        self.delay_factor = float(config["CRAWLER"].get("DELAYFACTOR", "2"))
+        self.cooldown_failures = int(config["CRAWLER"].get("COOLDOWNFAILURES", "5"))
+        self.cooldown = float(config["CRAWLER"].get("COOLDOWN", "300"))
+        self.parser_backend = config["CRAWLER"].get("PARSER", "stream").strip()
+        self.priority = config["CRAWLER"].get("PRIORITY", "best_first").strip()
+        self.near_dup_distance = int(config["CRAWLER"].get("NEARDUPDISTANCE", "3"))
+        self.trap_budget = int(config["CRAWLER"].get("TRAPBUDGET", "2000"))
+        self.trap_min_pages = int(config["CRAWLER"].get("TRAPMINPAGES", "20"))
+        self.trap_low_info_ratio = float(config["CRAWLER"].get("TRAPLOWINFO", "0.5"))
+
+        # Older config files have no [DOWNLOAD] or [SHARDS] section.
+        download = config["DOWNLOAD"] if "DOWNLOAD" in config else {}
+        self.pool_size = int(download.get("POOLSIZE", "8"))
+        self.downloads_in_flight = int(download.get("INFLIGHT", "1"))
+        self.download_timeout = float(download.get("TIMEOUT", "30"))
+        self.download_retries = int(download.get("RETRIES", "2"))
+        self.download_backoff = float(download.get("BACKOFF", "1.0"))
+        self.max_response_bytes = int(download.get("MAXBYTES", "5000000"))
+
+        # Multi-process crawl (launch.py --shards); shard_id and shard_peers
+        # are filled in by crawler.shard.configure_shard.
+        shards = config["SHARDS"] if "SHARDS" in config else {}
+        self.shard_peers_spec = shards.get("PEERS", "").strip()
+        self.shard_base_port = int(shards.get("BASEPORT", "9100"))
+        self.shard_batch = int(shards.get("BATCH", "100"))
+        self.shard_flush_interval = float(shards.get("FLUSHINTERVAL", "1.0"))
+        self.shard_idle = float(shards.get("IDLE", "5"))
+        self.shard_authkey_spec = shards.get("AUTHKEY", "").strip()
+        self.shard_id = None
+        self.shard_peers = None
 
         self.cache_server = None # assigned a value when launch.py runs 
\ No newline at end of file
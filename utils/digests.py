@@ -0,0 +1,62 @@
+import os
+
+from hashlib import blake2b
+from threading import Lock
+
+DIGEST_SIZE = 16
+
+
+def content_digest(text: str) -> bytes:
+    return blake2b(text.encode("utf-8"), digest_size=DIGEST_SIZE).digest()
+
+
+class ContentDigestIndex(object):
+    """
+    Set of content digests of pages already processed, for exact-duplicate
+    detection (mirror hosts, http vs https, query variants).
+    Digests added since the last save are appended to the save file, so a
+    checkpoint writes only what is new; a torn tail is cut off on load.
+    """
+    def __init__(self):
+        self.digests = set()
+        self.unsaved = list()
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.digests)
+
+    def check_and_add(self, digest):
+        ''' Return True if digest was seen before; otherwise remember it. '''
+        with self.lock:
+            if digest in self.digests:
+                return True
+            self.digests.add(digest)
+            self.unsaved.append(digest)
+            return False
+
+    def save(self, path):
+        with self.lock:
+            if not self.unsaved:
+                return
+            with open(path, "ab") as f:
+                f.write(b"".join(self.unsaved))
+                f.flush()
+                os.fsync(f.fileno())
+            self.unsaved.clear()
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                data = f.read()
+            end = len(data) - len(data) % DIGEST_SIZE
+            if end < len(data):
+                # Cut the torn tail off, or every digest appended after it
+                # would be read back misaligned.
+                with open(path, "r+b") as f:
+                    f.truncate(end)
+                    os.fsync(f.fileno())
+            index.digests = {
+                data[i:i + DIGEST_SIZE] for i in range(0, end, DIGEST_SIZE)}
+        return index
@@ -1,21 +1,87 @@
 import requests
-import cbor # packaging format for data sent 
+import cbor # packaging format for data sent
 import time
 
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from requests.adapters import HTTPAdapter
+
+from utils.canonical import canonicalize
 from utils.response import Response
+from utils.stats import STATS
 
-def download(url, config, logger=None):
+CACHE_ERRORS = range(600, 609) # cache server specific statuses, retried with backoff
+
+# One keep-alive session (and fetch pool) shared by every worker thread, since
+# all requests go to the same cache server.
+_session = None
+_executor = None
+_lock = Lock()
+
+
+def get_session(config):
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            # pool_block makes threads wait for a free connection instead of
+            # opening (and then discarding) extra ones.
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=config.pool_size, pool_block=True)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def _fetch(url, config, logger):
     host, port = config.cache_server
-    resp = requests.get(
-        f"http://{host}:{port}/",
-        params=[("q", f"{url}"), ("u", f"{config.user_agent}")])
+    start = time.perf_counter()
+    try:
+        resp = get_session(config).get(
+            f"http://{host}:{port}/",
+            params=[("q", f"{url}"), ("u", f"{config.user_agent}")],
+            timeout=config.download_timeout)
+    except requests.RequestException as e:
+        STATS.count("download.request_error")
+        if logger:
+            logger.error(f"Spacetime request failed with url {url}: {e}")
+        return Response({
+            "error": f"Spacetime request failed with url {url}: {e}",
+            "status": 0, # no HTTP status at all
+            "url": url})
+    STATS.observe("download", time.perf_counter() - start, canonicalize(url).host)
     try:
         if resp and resp.content:
-            return Response(cbor.loads(resp.content))
+            with STATS.timer("cbor"): # the page itself is unpickled lazily, see Response
+                return Response(cbor.loads(resp.content), config.max_response_bytes)
     except (EOFError, ValueError) as e:
         pass
-    logger.error(f"Spacetime Response error {resp} with url {url}.")
+    if logger:
+        logger.error(f"Spacetime Response error {resp} with url {url}.")
     return Response({
         "error": f"Spacetime Response error {resp} with url {url}.",
         "status": resp.status_code,
         "url": url})
+
+
+def download(url, config, logger=None):
+    ''' Fetch url through the cache server, retrying cache errors (6xx) with
+    exponential backoff. '''
+    for attempt in range(config.download_retries + 1):
+        start = time.perf_counter()
+        resp = _fetch(url, config, logger)
+        resp.download_time = time.perf_counter() - start # feeds the host's adaptive delay
+        if resp.status not in CACHE_ERRORS or attempt == config.download_retries:
+            return resp
+        STATS.count("download.retry")
+        time.sleep(config.download_backoff * 2 ** attempt)
+
+
+def download_async(url, config, logger=None):
+    ''' Start download(url) on the shared fetch pool and return its Future,
+    so a worker can keep several fetches in flight while it parses. '''
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=config.pool_size, thread_name_prefix="download")
+    return _executor.submit(download, url, config, logger)
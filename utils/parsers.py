@@ -0,0 +1,202 @@
+"""
+Interchangeable HTML backends for the scraper.
+Each backend takes the page content (and the charset of its Content-Type
+header, if any) and returns (text, hrefs):
+    text  -- visible text, whitespace collapsed to single spaces
+    hrefs -- href value of every <a href> in document order, unresolved
+All backends skip the same elements so their outputs are interchangeable;
+benchmarks/parse_backends.py checks that on a saved corpus.
+"""
+import codecs
+import re
+
+from html import escape
+from html.parser import HTMLParser
+
+# Elements whose text is never visible (BeautifulSoup's get_text skips these too).
+HIDDEN_TAGS = {"script", "style", "template", "rt", "rp"}
+# Ruby annotations; their end tags are optional (the next rt/rp or </ruby>
+# closes them), so they cannot be counted like the other hidden elements.
+RUBY_TEXT_TAGS = {"rt", "rp"}
+
+
+BOMS = ( # these codecs drop the byte order mark they find
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+META_PRESCAN_BYTES = 1024 # a <meta charset> must appear this early (HTML spec)
+META_CHARSET_PATTERN = re.compile(
+    rb"""<meta[^>]+?charset\s*=\s*["']?\s*([a-z0-9_.:-]+)""", re.IGNORECASE)
+CDATA_PATTERN = re.compile(r"<!\[CDATA\[(.*?)\]\]>", re.DOTALL)
+HEADER_CHARSET_PATTERN = re.compile(
+    r"""charset\s*=\s*["']?\s*([a-z0-9_.:-]+)""", re.IGNORECASE)
+
+
+def _codec(name):
+    ''' Python codec for a declared charset name, or None if unknown.
+    Browsers read latin-1 and ascii pages as windows-1252. '''
+    try:
+        codec = codecs.lookup(name).name
+    except LookupError:
+        return None
+    return "cp1252" if codec in ("latin-1", "iso8859-1", "ascii") else codec
+
+
+def header_charset(content_type):
+    ''' charset parameter of a Content-Type header value, or None. '''
+    match = HEADER_CHARSET_PATTERN.search(content_type or "")
+    return match.group(1) if match else None
+
+
+def find_encoding(content: bytes, encoding=None):
+    '''
+    Encoding of page bytes, in the order browsers use: a byte order mark,
+    then the charset from the Content-Type header (encoding), then a
+    <meta charset> or http-equiv declaration early in the page.
+    None if the page declares nothing usable.
+    '''
+    for bom, codec in BOMS:
+        if content.startswith(bom):
+            return codec
+    codec = _codec(encoding) if encoding else None
+    if codec is not None:
+        return codec
+    match = META_CHARSET_PATTERN.search(content, 0, META_PRESCAN_BYTES)
+    if match:
+        codec = _codec(match.group(1).decode("ascii"))
+        # A page that was decoded far enough to read its meta is not UTF-16.
+        return "utf-8" if codec and codec.startswith("utf-16") else codec
+    return None
+
+
+def decode_content(content, encoding=None) -> str:
+    ''' Decode page bytes once so every backend parses the same string.
+    encoding is the charset of the Content-Type header, if any; see
+    find_encoding. Pages that declare nothing are read as UTF-8, or as
+    windows-1252 if they are not valid UTF-8. '''
+    if isinstance(content, str):
+        return content
+    codec = find_encoding(content, encoding)
+    if codec is not None:
+        return content.decode(codec, errors="replace")
+    try:
+        return content.decode("utf-8")
+    except UnicodeDecodeError:
+        return content.decode("cp1252", errors="replace")
+
+
+def _collapse(chunks) -> str:
+    return " ".join(" ".join(chunks).split())
+
+
+def extract_bs4(content, encoding=None):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(
+        decode_content(content, encoding), "html.parser",
+        on_duplicate_attribute="ignore") # the first duplicate wins, as in browsers
+    # Sources : https://stackoverflow.com/questions/30565404/remove-all-style-scripts-and-html-tags-from-an-html-page
+    for tag in soup(["script", "style"]):
+        tag.decompose()
+    text = " ".join(soup.get_text(separator=" ").split())
+    hrefs = [tag["href"] for tag in soup.find_all("a", href=True)]
+    return text, hrefs
+
+
+class StreamExtractor(HTMLParser):
+    """
+    SAX-style extractor: collects visible text and hrefs in a single pass
+    over the tokenizer events, without building a tree.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = list()
+        self.hrefs = list()
+        self.hidden_depth = 0 # > 0 while inside a HIDDEN_TAGS element other than rt/rp
+        self.in_ruby_text = False # inside an rt or rp element
+
+    @property
+    def hidden(self):
+        return self.hidden_depth or self.in_ruby_text
+
+    def handle_starttag(self, tag, attrs):
+        if tag in RUBY_TEXT_TAGS:
+            self.in_ruby_text = True # also closes an rt/rp left open
+        elif tag in HIDDEN_TAGS:
+            self.hidden_depth += 1
+        elif tag == "a":
+            self._add_href(attrs)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag == "a":
+            self._add_href(attrs)
+
+    def handle_endtag(self, tag):
+        if tag in RUBY_TEXT_TAGS or tag == "ruby":
+            self.in_ruby_text = False
+        elif tag in HIDDEN_TAGS and self.hidden_depth:
+            self.hidden_depth -= 1
+
+    def handle_data(self, data):
+        if not self.hidden:
+            self.chunks.append(data)
+
+    def unknown_decl(self, data):
+        if data.startswith("CDATA[") and not self.hidden:
+            self.chunks.append(data[len("CDATA["):])
+
+    def _add_href(self, attrs):
+        href = None
+        for name, value in attrs:
+            if name == "href":
+                href = value or ""
+                break # the first duplicate wins, as in browsers
+        if href is not None:
+            self.hrefs.append(href)
+
+
+def extract_stream(content, encoding=None):
+    parser = StreamExtractor()
+    parser.feed(decode_content(content, encoding))
+    parser.close()
+    return _collapse(parser.chunks), parser.hrefs
+
+
+def extract_lxml(content, encoding=None):
+    from lxml import html as lxml_html
+    text = decode_content(content, encoding)
+    if not text.strip():
+        return "", []
+    if "<![CDATA[" in text:
+        # libxml2 drops CDATA sections; the other backends keep their text.
+        text = CDATA_PATTERN.sub(lambda match: f" {escape(match.group(1), quote=False)} ", text)
+    # Hand lxml bytes with a fixed encoding so <?xml encoding=...?> is ignored.
+    parser = lxml_html.HTMLParser(encoding="utf-8")
+    root = lxml_html.document_fromstring(text.encode("utf-8"), parser=parser)
+    # Links inside hidden elements (e.g. <template>) count, as in the others.
+    hrefs = [a.get("href") for a in root.iter("a") if a.get("href") is not None]
+    for element in list(root.iter(*HIDDEN_TAGS)):
+        # Emptied rather than removed, so the tail stays a separate string
+        # and is not glued onto the word before the element.
+        element.clear(keep_tail=True)
+    return _collapse(root.itertext()), hrefs
+
+
+BACKENDS = {
+    "bs4": extract_bs4,
+    "stream": extract_stream,
+    "lxml": extract_lxml,
+}
+
+
+def get_extractor(name):
+    ''' Return the extract function for a backend name from config.ini. '''
+    if name not in BACKENDS:
+        raise ValueError(
+            f"Unknown parser backend {name!r}, expected one of {sorted(BACKENDS)}.")
+    if name == "lxml":
+        try:
+            import lxml.html
+        except ImportError:
+            raise ValueError("Parser backend 'lxml' needs lxml installed.")
+    return BACKENDS[name]
@@ -0,0 +1,446 @@
+import os
+import json
+import heapq
+import time
+import marshal
+import struct
+
+from array import array
+from collections import Counter
+from threading import RLock, Thread
+
+from utils import atomic_write
+from utils.canonical import canonicalize
+
+# Summary files are rewritten after this many pages or seconds, and at close().
+FLUSH_PAGES = 100
+FLUSH_INTERVAL = 60.0
+TOP_WORDS = 50
+STATE_FILE = "report_state.json" # full state written at close(), see merge_reports()
+CHECKPOINT_MAGIC = b"RPT1"
+SECTION = struct.Struct("<Q") # length prefix of each checkpoint section
+RECORD = struct.Struct("<I") # length prefix of each delta log record
+DUPLICATE_KINDS = ("checked", "exact", "near")
+
+
+def _pack_counts(counts):
+    ''' dict of str -> int as two sections: newline-joined keys, array of counts. '''
+    return "\n".join(counts).encode("utf-8"), array("Q", counts.values()).tobytes()
+
+
+def _unpack_counts(keys, values):
+    counts = array("Q")
+    counts.frombytes(values)
+    return dict(zip(keys.decode("utf-8").split("\n"), counts)) if counts else {}
+
+
+def _write_checkpoint(path, seq, snapshot):
+    (unique_pages, word_freq, subdomain_counts, longest, duplicates, recorded,
+     top, duplicate_pages) = snapshot
+    meta = json.dumps({
+        "seq": seq, "longest_page": longest, "duplicates": duplicates,
+        "top_words": top}).encode("utf-8")
+    sections = [
+        meta, *_pack_counts(word_freq), *_pack_counts(subdomain_counts),
+        "\n".join(unique_pages).encode("utf-8"), array("Q", recorded).tobytes(),
+        *(array("Q", duplicate_pages[kind]).tobytes() for kind in DUPLICATE_KINDS)]
+    atomic_write(path, CHECKPOINT_MAGIC + b"".join(
+        SECTION.pack(len(section)) + section for section in sections))
+
+
+def _read_sections(data):
+    sections = list()
+    offset = len(CHECKPOINT_MAGIC)
+    while offset < len(data):
+        (size,) = SECTION.unpack_from(data, offset)
+        offset += SECTION.size
+        sections.append(data[offset:offset + size])
+        offset += size
+    return sections
+
+
+def _read_records(path):
+    ''' Yield the records of a delta log, stopping at a torn tail. '''
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset + RECORD.size <= len(data):
+        (size,) = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if offset + size > len(data):
+            return
+        yield marshal.loads(data[offset:offset + size])
+        offset += size
+
+
+class Report(object):
+    """
+    Crawl analytics behind the report/ files.
+    Updates are cheap: unique pages are appended to unique_pages.log as they
+    are found, and the top words are maintained incrementally (counts only
+    grow, so a word can only enter the top set by beating its current worst
+    member). The summary files are rewritten on a page-count interval, on a
+    timer, and at close(), not after every page.
+
+    With restore(path) the state also survives restarts: every change is
+    appended to a delta log (path.delta) that commit() makes durable before
+    the frontier commits its journal, and checkpoint() writes a compact
+    binary snapshot to path from a background thread and starts a new delta
+    log. Records carry a sequence number, so replaying a log the snapshot
+    already covers is harmless, and each page is counted once, in the word
+    counts and in the duplicate counts, even if it is crawled again after a
+    crash.
+    """
+    def __init__(self, report_dir, flush_pages=FLUSH_PAGES, flush_interval=FLUSH_INTERVAL):
+        self.report_dir = report_dir
+        self.flush_pages = flush_pages
+        self.flush_interval = flush_interval
+        self.lock = RLock()
+
+        self.unique_pages = set()
+        self.word_freq: dict[str, int] = {}
+        self.subdomain_counts: dict[str, int] = {}
+        self.longest_page_url = ""
+        self.longest_page_words = 0
+        self.duplicates = Counter() # "checked", "exact" and "near" page counts
+
+        self.top_words = set() # the TOP_WORDS best words by (-count, word)
+        self.top_worst = None # worst member of top_words, None if not full
+        self.unique_log = None # opened on the first unique page
+        self.pages_since_flush = 0
+        self.last_flush = time.time()
+
+        self.recorded = set() # canonical hash of every page in word_freq
+        # kind -> canonical hash of every page counted in duplicates[kind]
+        self.duplicate_pages = {kind: set() for kind in DUPLICATE_KINDS}
+        self.path = None # checkpoint file, set by restore()
+        self.seq = 0 # sequence number of the last change
+        self.delta = None # open delta log, unbuffered
+        self.dirty = False # delta log written since the last fsync
+        self.writer = None # thread writing the last checkpoint
+
+    def _log(self, *record):
+        # Written straight through: the frontier's save file reaches the OS
+        # as soon as a page completes, so the report must not lag behind it.
+        if self.delta is not None:
+            self.seq += 1
+            data = marshal.dumps((self.seq, *record))
+            self.delta.write(RECORD.pack(len(data)) + data)
+            self.dirty = True
+
+    def add_unique_page(self, url: str) -> None:
+        with self.lock:
+            if url in self.unique_pages:
+                return
+            self.unique_pages.add(url)
+            self._log("u", url)
+            self._open_unique_log()
+            self.unique_log.write(url + "\n")
+
+    def _open_unique_log(self):
+        if self.unique_log is None:
+            os.makedirs(self.report_dir, exist_ok=True)
+            self.unique_log = open(
+                os.path.join(self.report_dir, "unique_pages.log"), "w",
+                encoding="utf-8")
+
+    def add_page(self, url: str, host: str, word_count: int, term_counts) -> None:
+        ''' Record an accepted page and flush the summaries if one is due. '''
+        with self.lock:
+            if self._add_page(url, host, word_count, term_counts):
+                self._log("p", url, host, word_count, dict(term_counts))
+            self.pages_since_flush += 1
+            if (self.pages_since_flush >= self.flush_pages
+                    or time.time() - self.last_flush >= self.flush_interval):
+                self.flush()
+
+    def _add_page(self, url, host, word_count, term_counts):
+        key = canonicalize(url).hash
+        if key in self.recorded:
+            return False # crawled again after a restart
+        self.recorded.add(key)
+        for token, count in term_counts.items():
+            self.word_freq[token] = self.word_freq.get(token, 0) + count
+            self._update_top_words(token)
+        if host:
+            self.subdomain_counts[host] = self.subdomain_counts.get(host, 0) + 1
+        if word_count > self.longest_page_words:
+            self.longest_page_words = word_count
+            self.longest_page_url = url
+        return True
+
+    def count_duplicate(self, kind: str, url: str) -> None:
+        ''' kind is "checked" for every page tested, else "exact" or "near". '''
+        with self.lock:
+            key = canonicalize(url).hash
+            if self._count_duplicate(kind, key):
+                self._log("d", kind, key)
+
+    def _count_duplicate(self, kind, key):
+        pages = self.duplicate_pages[kind]
+        if key in pages:
+            return False # crawled again after a restart
+        pages.add(key)
+        self.duplicates[kind] += 1
+        return True
+
+    def _rank(self, word):
+        return (-self.word_freq[word], word)
+
+    def _update_top_words(self, word):
+        if word in self.top_words:
+            if word == self.top_worst: # its count went up, the worst may change
+                self.top_worst = max(self.top_words, key=self._rank)
+            return
+        if len(self.top_words) < TOP_WORDS:
+            self.top_words.add(word)
+            if len(self.top_words) == TOP_WORDS:
+                self.top_worst = max(self.top_words, key=self._rank)
+        elif self._rank(word) < self._rank(self.top_worst):
+            self.top_words.remove(self.top_worst)
+            self.top_words.add(word)
+            self.top_worst = max(self.top_words, key=self._rank)
+
+    def top_words_report(self):
+        return sorted(
+            ((word, self.word_freq[word]) for word in self.top_words),
+            key=lambda kv: (-kv[1], kv[0]))
+
+    def flush(self) -> None:
+        ''' Rewrite every summary file from the current state. '''
+        with self.lock:
+            os.makedirs(self.report_dir, exist_ok=True)
+            if self.unique_log is not None:
+                self.unique_log.flush()
+            self._write_unique_pages()
+            self._write_longest_page()
+            self._write_top_words()
+            self._write_subdomains()
+            self._write_duplicates()
+            self.pages_since_flush = 0
+            self.last_flush = time.time()
+
+    def close(self) -> None:
+        with self.lock:
+            self.commit()
+            self.flush()
+            self.save_state()
+            if self.unique_log is not None:
+                self.unique_log.close()
+                self.unique_log = None
+            if self.delta is not None:
+                self.delta.close()
+                self.delta = None
+        self._join_writer()
+
+    def restore(self, path) -> None:
+        ''' Load the checkpoint at path and replay its delta logs, then log
+        every later change so checkpoint() can save it. '''
+        with self.lock:
+            seq = 0
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    data = f.read()
+                if data.startswith(CHECKPOINT_MAGIC):
+                    sections = _read_sections(data)
+                    meta, words, word_counts, hosts, host_counts, unique, recorded = (
+                        sections[:7])
+                    meta = json.loads(meta)
+                    seq = meta["seq"]
+                    self.longest_page_url, self.longest_page_words = meta["longest_page"]
+                    self.duplicates.update(meta["duplicates"])
+                    self.word_freq = _unpack_counts(words, word_counts)
+                    self.subdomain_counts = _unpack_counts(hosts, host_counts)
+                    if unique:
+                        self.unique_pages.update(unique.decode("utf-8").split("\n"))
+                    keys = array("Q")
+                    keys.frombytes(recorded)
+                    self.recorded.update(keys)
+                    # Checkpoints from before duplicate pages were kept end here.
+                    for kind, section in zip(DUPLICATE_KINDS, sections[7:]):
+                        keys = array("Q")
+                        keys.frombytes(section)
+                        self.duplicate_pages[kind].update(keys)
+                    # Saved rather than rebuilt: ranking millions of words
+                    # would dominate the load time.
+                    self.top_words = set(meta["top_words"])
+                    self.top_worst = (
+                        max(self.top_words, key=self._rank)
+                        if len(self.top_words) == TOP_WORDS else None)
+            replayed = 0
+            for log in (f"{path}.delta.old", f"{path}.delta"):
+                for record in _read_records(log):
+                    if record[0] > seq:
+                        seq = record[0]
+                        self._replay(record[1:])
+                        replayed += 1
+            self.path = path
+            self.seq = seq
+            if replayed:
+                # Fold the logs (the newest possibly torn) into the
+                # checkpoint before starting a new one.
+                _write_checkpoint(path, seq, self._snapshot())
+            for log in (f"{path}.delta.old", f"{path}.delta"):
+                if os.path.exists(log):
+                    os.remove(log)
+            self.delta = open(f"{path}.delta", "wb", buffering=0)
+            if self.unique_pages:
+                self._open_unique_log()
+                self.unique_log.write("".join(url + "\n" for url in self.unique_pages))
+
+    def _replay(self, record):
+        kind = record[0]
+        if kind == "u":
+            self.unique_pages.add(record[1])
+        elif kind == "p":
+            self._add_page(*record[1:])
+        elif len(record) == 3: # "d"
+            self._count_duplicate(*record[1:])
+        else: # "d" logged before duplicate pages were kept
+            self.duplicates[record[1]] += 1
+
+    def commit(self) -> None:
+        ''' fsync the changes logged so far. The frontier calls this before
+        it commits its journal, so no completed page misses them. '''
+        with self.lock:
+            if self.delta is not None and self.dirty:
+                os.fsync(self.delta.fileno())
+                self.dirty = False
+
+    def checkpoint(self) -> None:
+        ''' Save the whole state to the checkpoint file in the background
+        and start a new delta log. Only the copy of the state is taken under
+        the lock; encoding and writing it happen in a writer thread. '''
+        if self.path is None:
+            return
+        self._join_writer() # at most one checkpoint written at a time
+        with self.lock:
+            self.commit()
+            self._rotate_delta()
+            self.writer = Thread(
+                target=self._write_checkpoint, args=(self.seq, self._snapshot()),
+                name="report-checkpoint", daemon=True)
+            self.writer.start()
+
+    def _snapshot(self):
+        return (
+            list(self.unique_pages), dict(self.word_freq),
+            dict(self.subdomain_counts),
+            [self.longest_page_url, self.longest_page_words],
+            dict(self.duplicates), list(self.recorded), list(self.top_words),
+            {kind: list(pages) for kind, pages in self.duplicate_pages.items()})
+
+    def _rotate_delta(self):
+        ''' Move the delta log to path.delta.old and open a new one. '''
+        delta, old = f"{self.path}.delta", f"{self.path}.delta.old"
+        if self.delta is not None:
+            self.delta.close()
+            if os.path.exists(old): # the last checkpoint failed, keep both
+                with open(old, "ab") as f, open(delta, "rb") as g:
+                    f.write(g.read())
+                os.remove(delta)
+            else:
+                os.replace(delta, old)
+        self.delta = open(delta, "wb", buffering=0)
+
+    def _write_checkpoint(self, seq, snapshot):
+        _write_checkpoint(self.path, seq, snapshot)
+        old = f"{self.path}.delta.old"
+        if os.path.exists(old):
+            os.remove(old) # its records are in the checkpoint now
+
+    def _join_writer(self):
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+
+    def save_state(self) -> None:
+        ''' Write everything the summaries are built from, so reports of
+        several crawler shards can be merged. '''
+        with self.lock:
+            os.makedirs(self.report_dir, exist_ok=True)
+            state = {
+                "unique_pages": sorted(self.unique_pages),
+                "word_freq": self.word_freq,
+                "subdomain_counts": self.subdomain_counts,
+                "longest_page": [self.longest_page_url, self.longest_page_words],
+                "duplicates": dict(self.duplicates)}
+            atomic_write(
+                os.path.join(self.report_dir, STATE_FILE),
+                json.dumps(state).encode("utf-8"))
+
+    def merge_state(self, state) -> None:
+        ''' Add a state written by save_state() into this report. '''
+        with self.lock:
+            self.unique_pages.update(state["unique_pages"])
+            for word, count in state["word_freq"].items():
+                self.word_freq[word] = self.word_freq.get(word, 0) + count
+            for host, count in state["subdomain_counts"].items():
+                self.subdomain_counts[host] = self.subdomain_counts.get(host, 0) + count
+            url, words = state["longest_page"]
+            if words > self.longest_page_words:
+                self.longest_page_url, self.longest_page_words = url, words
+            self.duplicates.update(state["duplicates"])
+            # Counts of existing words changed too, so rebuild the top set.
+            self._rebuild_top_words()
+
+    def _rebuild_top_words(self):
+        self.top_words = set(heapq.nsmallest(TOP_WORDS, self.word_freq, key=self._rank))
+        self.top_worst = (
+            max(self.top_words, key=self._rank)
+            if len(self.top_words) == TOP_WORDS else None)
+
+    def _write_unique_pages(self):
+        out_path = os.path.join(self.report_dir, "unique_pages.txt")
+        with open(out_path, "w", encoding="utf-8") as f:
+            f.write(f"Unique pages: {len(self.unique_pages)}\n")
+            f.write("\n")
+            for u in sorted(self.unique_pages):
+                f.write(u + "\n")
+
+    def _write_longest_page(self):
+        out_path = os.path.join(self.report_dir, "longest_page.txt")
+        with open(out_path, "w", encoding="utf-8") as f:
+            f.write(f"Longest page (num of words): {self.longest_page_words}\n")
+            f.write(f"URL: {self.longest_page_url}\n")
+
+    def _write_top_words(self):
+        out_path = os.path.join(self.report_dir, "common_words.txt")
+        with open(out_path, "w", encoding="utf-8") as f:
+            for word, count in self.top_words_report():
+                f.write(f"{word}, {count}\n")
+
+    def _write_subdomains(self):
+        out_path = os.path.join(self.report_dir, "subdomains.txt")
+        with open(out_path, "w", encoding="utf-8") as f:
+            for host in sorted(self.subdomain_counts.keys()):
+                f.write(f"{host}, {self.subdomain_counts[host]}\n")
+
+    def _write_duplicates(self):
+        out_path = os.path.join(self.report_dir, "duplicates.txt")
+        checked = self.duplicates["checked"]
+        with open(out_path, "w", encoding="utf-8") as f:
+            f.write(f"Pages checked: {checked}\n")
+            for kind in ("exact", "near"):
+                hits = self.duplicates[kind]
+                rate = hits / checked if checked else 0.0
+                f.write(f"{kind.capitalize()} duplicates: {hits} ({rate:.1%})\n")
+
+
+def shard_report_dir(report_dir, shard_id) -> str:
+    return os.path.join(report_dir, f"shard{shard_id}")
+
+
+def merge_reports(report_dir, shard_report_dirs) -> Report:
+    ''' Combine the saved state of each shard's report into report_dir and
+    write its summary files. '''
+    report = Report(report_dir)
+    for shard_dir in shard_report_dirs:
+        path = os.path.join(shard_dir, STATE_FILE)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                report.merge_state(json.load(f))
+    report.close()
+    return report
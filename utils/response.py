@@ -1,19 +1,45 @@
 import pickle
 
+from utils.stats import STATS
+
 class Response(object):
     """
     Wrapper object around what the cache server sent back
-    Cache server sends a dictionary that contains : the URL, the HTTP status 
+    Cache server sends a dictionary that contains : the URL, the HTTP status
     and an optional error message
+    The pickled raw response is only decoded when raw_response (or headers)
+    is first read, so pages dropped on their status are never unpickled, and
+    a payload over max_bytes is never decoded at all (too_large is set).
+    There is no cheaper path to the headers alone: a pickled
+    requests.Response stores the body before the headers, so reading the
+    headers unpickles the whole page.
     """
-    def __init__(self, resp_dict):
+    def __init__(self, resp_dict, max_bytes=None):
         self.url = resp_dict["url"]
         self.status = resp_dict["status"]
         self.error = resp_dict["error"] if "error" in resp_dict else None
-        try:
-            self.raw_response = (
-                pickle.loads(resp_dict["response"]) # response is in bytes, and is turned back into Python object 
-                if "response" in resp_dict else
-                None) # raw_response is a python object 
-        except TypeError:
-            self.raw_response = None
+        self.download_time = None # seconds the last attempt took, set by utils.download
+        self._payload = resp_dict.get("response") # pickled requests.Response, until decoded
+        self._raw_response = None
+        # Size of the pickled response; an upper bound on the page size that
+        # is known without decoding anything.
+        self.payload_size = len(self._payload) if isinstance(self._payload, bytes) else 0
+        self.too_large = max_bytes is not None and self.payload_size > max_bytes
+
+    @property
+    def raw_response(self):
+        if self._payload is not None and not self.too_large:
+            payload, self._payload = self._payload, None # keep only the decoded copy
+            try:
+                with STATS.timer("decode"):
+                    self._raw_response = pickle.loads(payload) # response is in bytes, and is turned back into Python object
+            except TypeError:
+                self._raw_response = None
+        return self._raw_response # raw_response is a python object
+
+    @property
+    def headers(self):
+        ''' Headers of the raw response ({} if there is none). Decodes the
+        whole raw response, body included; see the class docstring. '''
+        raw_response = self.raw_response
+        return raw_response.headers if raw_response is not None else {}
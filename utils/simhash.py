@@ -0,0 +1,109 @@
+import os
+
+from array import array
+from functools import lru_cache
+from hashlib import blake2b
+from threading import Lock
+
+from utils import atomic_write
+
+FINGERPRINT_BITS = 64
+LANE_BITS = 32 # per-bit weight sums must stay below 2**LANE_BITS
+LANE_MASK = (1 << LANE_BITS) - 1
+# LANE_TABLE[b] spreads the 8 bits of b into 8 lanes of LANE_BITS bits each,
+# so one big-int multiply-add updates the weight sums of 8 bit positions.
+LANE_TABLE = [
+    sum(1 << (j * LANE_BITS) for j in range(8) if b >> j & 1)
+    for b in range(256)]
+
+
+def term_hash(term: str) -> int:
+    return int.from_bytes(blake2b(term.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+@lru_cache(maxsize=32768) # common terms repeat across pages
+def term_lanes(term: str) -> int:
+    ''' term_hash spread into one lane per bit. '''
+    h = term_hash(term)
+    spread = 0
+    for k in range(8):
+        spread |= LANE_TABLE[(h >> (8 * k)) & 0xFF] << (8 * k * LANE_BITS)
+    return spread
+
+
+def simhash(term_counts) -> int:
+    """
+    64-bit SimHash of a page: bit i is set when the terms whose hash has bit i
+    set carry more than half of the total weight.
+    """
+    lanes = 0 # 64 lanes, lane i holds the weight of terms with bit i set
+    total = 0
+    for term, weight in term_counts.items():
+        lanes += weight * term_lanes(term)
+        total += weight
+    fingerprint = 0
+    for i in range(FINGERPRINT_BITS):
+        if 2 * ((lanes >> (i * LANE_BITS)) & LANE_MASK) > total:
+            fingerprint |= 1 << i
+    return fingerprint
+
+
+class SimhashIndex(object):
+    """
+    Banded LSH index over SimHash fingerprints.
+    The 64 bits are split into max_distance + 1 bands. Two fingerprints within
+    max_distance bits of each other must agree exactly on at least one band
+    (pigeonhole), so only fingerprints sharing a band value are compared and
+    no near-duplicate is missed.
+    """
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        num_bands = max_distance + 1
+        width = FINGERPRINT_BITS // num_bands
+        self.bands = [ # (shift, mask) for each band; the last one takes the rest
+            (i * width, (1 << (width if i < num_bands - 1
+                               else FINGERPRINT_BITS - i * width)) - 1)
+            for i in range(num_bands)]
+        self.tables = [dict() for _ in self.bands] # band value -> fingerprints
+        self.fingerprints = array("Q")
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def find_near(self, fingerprint):
+        ''' Return a stored fingerprint within max_distance bits, or None. '''
+        for (shift, mask), table in zip(self.bands, self.tables):
+            for candidate in table.get((fingerprint >> shift) & mask, ()):
+                if (candidate ^ fingerprint).bit_count() <= self.max_distance:
+                    return candidate
+        return None
+
+    def add(self, fingerprint):
+        for (shift, mask), table in zip(self.bands, self.tables):
+            table.setdefault((fingerprint >> shift) & mask, []).append(fingerprint)
+        self.fingerprints.append(fingerprint)
+
+    def check_and_add(self, fingerprint):
+        ''' Return True if a near-duplicate is indexed; otherwise index it. '''
+        with self.lock:
+            if self.find_near(fingerprint) is not None:
+                return True
+            self.add(fingerprint)
+            return False
+
+    def save(self, path):
+        with self.lock:
+            atomic_write(path, self.fingerprints.tobytes())
+
+    @classmethod
+    def load(cls, path, max_distance=3):
+        index = cls(max_distance)
+        if os.path.exists(path):
+            fingerprints = array("Q")
+            with open(path, "rb") as f:
+                data = f.read()
+            fingerprints.frombytes(data[:len(data) - len(data) % fingerprints.itemsize])
+            for fingerprint in fingerprints:
+                index.add(fingerprint)
+        return index
@@ -0,0 +1,150 @@
+import json
+import os
+import time
+
+from collections import Counter
+from contextlib import contextmanager
+from threading import Lock
+
+# Histogram buckets double from 0.1 ms; the last one also takes anything slower.
+FIRST_BUCKET = 0.0001
+NUM_BUCKETS = 21 # up to ~105 s
+SLOWEST_HOSTS = 10 # hosts listed per dump, by mean download latency
+
+
+class Histogram(object):
+    """
+    Latency histogram with power-of-two buckets. Percentiles are reported as
+    the upper bound of the bucket they fall in, so they are within 2x.
+    """
+    def __init__(self):
+        self.buckets = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        index = 0
+        bound = FIRST_BUCKET
+        while seconds > bound and index < NUM_BUCKETS - 1:
+            index += 1
+            bound *= 2
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        rank = fraction * self.count
+        seen = 0
+        for index, hits in enumerate(self.buckets):
+            seen += hits
+            if seen >= rank:
+                return min(FIRST_BUCKET * 2 ** index, self.max)
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 3),
+            "p50_ms": round(self.percentile(0.5) * 1000, 3),
+            "p90_ms": round(self.percentile(0.9) * 1000, 3),
+            "p99_ms": round(self.percentile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3)}
+
+
+class Stats(object):
+    """
+    Per-stage timings and drop counters for the whole crawler.
+    Stages are timed with observe()/timer() (download, cbor, decode, parse,
+    tokenize, filter, frontier_add, report), drops are counted with
+    count("drop.<reason>"), and download latency is also kept per host.
+    maybe_dump() appends a JSON line snapshot to the stats file at most once
+    per interval; the counts are cumulative since startup. Components can
+    add gauges, callables whose result is included in each snapshot.
+    """
+    def __init__(self, path=None, interval=30.0):
+        self.path = path
+        self.interval = interval
+        self.lock = Lock()
+        self.histograms: dict[str, Histogram] = {}
+        self.host_histograms: dict[str, Histogram] = {} # download latency per host
+        self.counters = Counter()
+        self.gauges = dict() # name -> callable returning a JSON-able value
+        self.started = time.time()
+        self.last_dump = self.started
+
+    def configure(self, config):
+        self.path = config.stats_file
+        self.interval = config.stats_interval
+
+    def observe(self, stage, seconds, host=None):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+            if host:
+                histogram = self.host_histograms.get(host)
+                if histogram is None:
+                    histogram = self.host_histograms[host] = Histogram()
+                histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def gauge(self, name, read):
+        self.gauges[name] = read
+
+    def snapshot(self):
+        # Gauges take their owner's lock, which may be held by a thread
+        # waiting for ours, so they are read before it is taken.
+        gauges = {name: read() for name, read in list(self.gauges.items())}
+        with self.lock:
+            slowest = sorted(
+                self.host_histograms.items(),
+                key=lambda kv: kv[1].total / kv[1].count, reverse=True)[:SLOWEST_HOSTS]
+            return {
+                "time": round(time.time(), 3),
+                "uptime": round(time.time() - self.started, 3),
+                "stages": {
+                    stage: histogram.summary()
+                    for stage, histogram in sorted(self.histograms.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "gauges": gauges,
+                "slowest_hosts": {
+                    host: histogram.summary() for host, histogram in slowest}}
+
+    def maybe_dump(self):
+        with self.lock:
+            if not self.path or time.time() - self.last_dump < self.interval:
+                return
+            self.last_dump = time.time() # claim this dump before another thread does
+        self.dump()
+
+    def dump(self):
+        ''' Append one snapshot to the stats file. '''
+        if not self.path:
+            return
+        line = json.dumps(self.snapshot())
+        with self.lock:
+            self.last_dump = time.time()
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+STATS = Stats() # shared by the frontier, workers, downloads and the scraper
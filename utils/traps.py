@@ -0,0 +1,142 @@
+import os
+import re
+
+from array import array
+from functools import lru_cache
+from hashlib import blake2b
+from threading import Lock
+from urllib.parse import urlsplit, parse_qsl
+
+from utils import atomic_write
+
+# Variable parts of a url, replaced in this order inside each path segment
+# and query value.
+HEX_ID_PATTERN = re.compile( # hex ids with both digits and letters, and uuids
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
+    r"|(?<![0-9a-z])(?=[0-9a-f]*\d)(?=[0-9a-f]*[a-f])[0-9a-f]{8,}(?![0-9a-z])",
+    re.IGNORECASE)
+DATE_PATTERN = re.compile(r"(?<!\d)(?:\d{4}[-_]\d{1,2}(?:[-_]\d{1,2})?|\d{8})(?!\d)")
+NUMBER_PATTERN = re.compile(r"\d+")
+RECORD = 4 # hash, enqueued, fetched, low_info: one array("Q") record per template
+
+
+def abstract(part):
+    part = HEX_ID_PATTERN.sub("{id}", part)
+    part = DATE_PATTERN.sub("{date}", part)
+    return NUMBER_PATTERN.sub("{n}", part)
+
+
+def url_template(url):
+    """
+    Shape of url with numbers, dates and ids replaced and the query keys
+    sorted, e.g. https://h/events/?page=12&day=2024-01-05 becomes
+    h/events/?day={date}&page={n}. Other values are kept, so ?do=diff
+    and ?do=edit stay different templates.
+    """
+    parsed = urlsplit(url)
+    path = "/".join(abstract(segment) for segment in parsed.path.split("/"))
+    query = "&".join(
+        f"{key}={abstract(value)}"
+        for key, value in sorted(parse_qsl(parsed.query, keep_blank_values=True)))
+    return f"{(parsed.hostname or '').lower()}{path}?{query}"
+
+
+def template_hash(template):
+    return int.from_bytes(blake2b(template.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+@lru_cache(maxsize=4096)
+def template_key(url):
+    ''' template_hash(url_template(url)), memoized: each queued url is
+    looked up when admitted, scored, handed out and fetched. '''
+    return template_hash(url_template(url))
+
+
+class TrapDetector(object):
+    """
+    Learns crawler traps from url templates (see url_template).
+    For each template it counts the urls enqueued, the pages fetched and how
+    many of those were low-info or duplicates. A template is closed once it
+    has had `budget` urls enqueued, or once at least `min_pages` of its pages
+    were fetched and `low_info_ratio` of them were low-info. Only a 64-bit
+    hash and three counters are kept per template.
+    """
+    def __init__(self, budget=2000, min_pages=20, low_info_ratio=0.5):
+        self.budget = budget
+        self.min_pages = min_pages
+        self.low_info_ratio = low_info_ratio
+        self.templates = dict() # template hash -> [enqueued, fetched, low_info]
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.templates)
+
+    def _closed(self, counts):
+        enqueued, fetched, low_info = counts
+        if self.budget and enqueued >= self.budget:
+            return "trap_budget"
+        if fetched >= self.min_pages and low_info >= self.low_info_ratio * fetched:
+            return "trap_low_info"
+        return None
+
+    def check(self, url):
+        ''' Return why url's template is closed, or None. '''
+        with self.lock:
+            counts = self.templates.get(template_key(url))
+            return self._closed(counts) if counts else None
+
+    def admit(self, url):
+        ''' Count url as enqueued if its template is still open. Returns the
+        reason it is refused, or None if it was admitted. '''
+        key = template_key(url)
+        with self.lock:
+            counts = self.templates.get(key)
+            if counts is None:
+                counts = self.templates[key] = [0, 0, 0]
+            reason = self._closed(counts)
+            if reason is None:
+                counts[0] += 1
+            return reason
+
+    def record_page(self, url, low_info):
+        ''' Count a fetched page of url's template. Returns the reason the
+        template was closed if this page closed it, else None. '''
+        key = template_key(url)
+        with self.lock:
+            counts = self.templates.get(key)
+            if counts is None:
+                counts = self.templates[key] = [0, 0, 0]
+            was_closed = self._closed(counts)
+            counts[1] += 1
+            counts[2] += bool(low_info)
+            reason = self._closed(counts)
+            return reason if reason and not was_closed else None
+
+    def low_info_share(self, url):
+        ''' Share of low-info pages among the fetched pages of url's
+        template, smoothed so a template with no history scores 0.5. '''
+        with self.lock:
+            counts = self.templates.get(template_key(url))
+            fetched, low_info = (counts[1], counts[2]) if counts else (0, 0)
+        return (low_info + 1) / (fetched + 2)
+
+    def save(self, path):
+        with self.lock:
+            records = array("Q")
+            for key, counts in self.templates.items():
+                records.append(key)
+                records.extend(counts)
+            atomic_write(path, records.tobytes())
+
+    @classmethod
+    def load(cls, path, budget=2000, min_pages=20, low_info_ratio=0.5):
+        detector = cls(budget, min_pages, low_info_ratio)
+        if os.path.exists(path):
+            records = array("Q")
+            with open(path, "rb") as f:
+                data = f.read()
+            size = RECORD * records.itemsize
+            records.frombytes(data[:len(data) - len(data) % size])
+            for i in range(0, len(records), RECORD):
+                detector.templates[records[i]] = list(records[i + 1:i + RECORD])
+        return detector
@@ -0,0 +1,113 @@
+import re
+
+from collections import Counter
+from functools import lru_cache
+from threading import Lock
+from urllib.parse import urlparse, parse_qsl
+
+# Number of recent verdicts kept, keyed on the (already canonical) url string.
+CACHE_SIZE = 4096
+
+AUTH_KEYS = ("/auth/", "/signin", "/login", "/logout", "/oauth") # authentication related urls
+FILE_EXTENSION_PATTERN = re.compile(
+    r"\.(css|js|bmp|gif|jpe?g|ico"
+    + r"|png|tiff?|mid|mp2|mp3|mp4"
+    + r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
+    + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
+    + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
+    + r"|epub|dll|cnf|tgz|sha1"
+    + r"|thmx|mso|arff|rtf|jar|csv"
+    + r"|rm|smil|wmv|swf|wma|zip|rar|gz)$")
+# --- TRAP DETECTIONS ---
+#Reference: https://developers.google.com/search/docs/crawling-indexing/url-structure, https://support.archive-it.org/hc/en-us/articles/208332943-How-to-identify-and-avoid-crawler-traps, https://en.wikipedia.org/wiki/Spider_trap
+#1. Avoid infinite calendar trap: for example, URLs with /calendar/2024/01/01, /calendar/2024/01/01, etc.
+CALENDAR_PATTERN = re.compile(r"/calendar/\d{4}/\d{1,2}/\d{1,2}")
+#2. Avoid session IDs in query session=, sid=, jseesionid=
+SESSION_KEYS = {"session", "sid", "jsessionid"}
+SESSION_HINT = re.compile(r"session|sid", re.IGNORECASE) # cheap pre-check before parse_qsl
+#3. Avoid spider traps / manual patterns, e.g. very long numeric path segments
+MAX_SEGMENT_LENGTH = 50
+
+
+class HostSuffixTrie(object):
+    """
+    Reversed-label trie over allowed host suffixes such as ".ics.uci.edu".
+    A host matches when a suffix is a proper label suffix of it, which is the
+    same as host.endswith(suffix) for dot-prefixed suffixes.
+    """
+    END = "" # marks the end of a suffix; never a real label
+
+    def __init__(self, suffixes):
+        self.root = dict()
+        for suffix in suffixes:
+            node = self.root
+            for label in reversed(suffix.strip(".").lower().split(".")):
+                node = node.setdefault(label, dict())
+            node[self.END] = True
+
+    def matches(self, host):
+        labels = host.split(".")
+        node = self.root
+        for depth, label in enumerate(reversed(labels)):
+            node = node.get(label)
+            if node is None:
+                return False
+            if self.END in node and depth + 1 < len(labels):
+                return True
+        return False
+
+
+class UrlFilter(object):
+    """
+    Compiled version of the scraper's is_valid rules.
+    check() returns the name of the first rule a url fails, or None if it
+    should be crawled. Verdicts are memoized per url string, and
+    filter_links() filters a whole page of links at once, counting
+    rejections per rule.
+    """
+    def __init__(self, allowed_suffixes, cache_size=CACHE_SIZE):
+        self.allowed = HostSuffixTrie(allowed_suffixes)
+        self.check = lru_cache(maxsize=cache_size)(self._check)
+        self.rejections = Counter() # reason -> links rejected by filter_links since startup
+        self.lock = Lock()
+
+    def _check(self, url):
+        try:
+            parsed = urlparse(url)
+            host = (parsed.hostname or "").lower() # hostnames are case-insensitive
+        except ValueError:
+            return "malformed"
+        if parsed.scheme not in ("http", "https"):
+            return "scheme"
+
+        path = parsed.path.lower()
+        if any(key in path for key in AUTH_KEYS):
+            return "auth_path"
+        if not self.allowed.matches(host): # host must be in allowed domain set
+            return "domain"
+        if FILE_EXTENSION_PATTERN.search(path):
+            return "file_extension"
+        if CALENDAR_PATTERN.search(path):
+            return "calendar_trap"
+        query = parsed.query
+        if query and SESSION_HINT.search(query):
+            if any(key.lower() in SESSION_KEYS for key, _ in parse_qsl(query)):
+                return "session_id"
+        if any(len(seg) > MAX_SEGMENT_LENGTH for seg in parsed.path.split("/")):
+            return "long_segment"
+        return None
+
+    def filter_links(self, urls):
+        ''' Return (kept urls, Counter of rejection reasons) for one page. '''
+        kept = list()
+        rejected = Counter()
+        for url in urls:
+            reason = self.check(url)
+            if reason is None:
+                kept.append(url)
+            else:
+                rejected[reason] += 1
+        if rejected:
+            with self.lock:
+                self.rejections.update(rejected)
+        return kept, rejected